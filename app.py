@@ -6,13 +6,12 @@ import random
 from datetime import datetime, timedelta
 import zipfile
 import numpy as np
-import textwrap
 from typing import Tuple, List, Optional
 import math
 import colorsys
 import traceback
 from collections import Counter
-#from streamlit.runtime.scriptrun_ctx import get_script_run_ctx
+from streamlit.runtime.scriptrunner import add_script_run_ctx
 import json
 import uuid
 import hashlib
@@ -20,39 +19,43 @@ import requests
 import gdown
 import tempfile
 import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
 import pandas as pd
 import os
 import tempfile
 import zipfile
 import gdown
 import streamlit as st
-from utils import smart_crop
+from utils import smart_crop, smart_crop_box, load_haar_cascade, detect_faces
+from asset_store import (ARCHIVE_NAME, cached_assets_root, sync_archive, mount_archive, is_archive_path, 
+                         list_dir, asset_exists, read_asset, open_asset, asset_version, open_bundle, bundle_image)
 import pytz  # Add this import for timezone support
 
 # 👇 Helper functions yaha paste karna hai
 def list_subfolders(folder):
     """Return list of subfolders inside a folder"""
-    if not os.path.exists(folder):
+    if not asset_exists(folder):
         return []
-    return [f for f in os.listdir(folder) if os.path.isdir(os.path.join(folder, f))]
+    return list_dir(folder)[0]
 
 def list_files(folder, extensions=None):
     """Return list of files inside a folder (filter by extension if given)"""
-    if not os.path.exists(folder):
+    if not asset_exists(folder):
         return []
     files = []
-    for f in os.listdir(folder):
+    for f in list_dir(folder)[1]:
         full_path = os.path.join(folder, f)
-        if os.path.isfile(full_path):
-            if extensions is None or any(f.lower().endswith(ext) for ext in extensions):
-                files.append(full_path)
+        if extensions is None or any(f.lower().endswith(ext) for ext in extensions):
+            files.append(full_path)
     return files
 
 
 def list_subfolders(directory):
     """Return a list of subfolder names in the given directory"""
-    return [name for name in os.listdir(directory) 
-            if os.path.isdir(os.path.join(directory, name))]
+    return list_dir(directory)[0]
 
 def apply_emoji_stickers(img: Image.Image, emojis: List[str], num_stickers=5, occupied_boxes: Optional[List[Tuple[int, int, int, int]]] = None) -> Image.Image:
     if occupied_boxes is None:
@@ -60,6 +63,12 @@ def apply_emoji_stickers(img: Image.Image, emojis: List[str], num_stickers=5, oc
     # rest of the code
 
 # Download and extract assets from Google Drive
+ASSET_CACHE_DIR = os.environ.get("ASSET_CACHE_DIR", os.path.join(os.getcwd(), "asset_cache"))
+ASSETS_ARCHIVE = os.environ.get("ASSETS_ARCHIVE")  # local zip to use instead of Google Drive
+ASSETS_OFFLINE = os.environ.get("ASSETS_OFFLINE", "0") == "1"  # never touch the network
+ASSETS_REFRESH_HOURS = float(os.environ.get("ASSETS_REFRESH_HOURS", "24"))
+ASSETS_MODE = os.environ.get("ASSETS_MODE", "extract")  # "zip" serves members straight from the archive
+
 @st.cache_resource
 def get_assets_dir():
     local_assets = os.path.join(os.getcwd(), "assets")  # check local "assets" folder
@@ -67,41 +76,607 @@ def get_assets_dir():
     if os.path.exists(local_assets):
         st.info("Using local assets folder ✅")
         return local_assets
+    
+    if ASSETS_MODE == "zip":
+        # One compressed copy on disk; listings and reads go through the archive index
+        return mount_archive(os.path.join(ASSET_CACHE_DIR, "archive"), get_assets_archive())
+    
+    if ASSETS_ARCHIVE:
+        # Only members that changed since the last sync are extracted
+        return sync_archive(ASSETS_ARCHIVE, ASSET_CACHE_DIR)
+    
+    # Reuse the tree extracted by an earlier run while it is fresh (or at any age when offline)
+    cached_root = cached_assets_root(ASSET_CACHE_DIR, None if ASSETS_OFFLINE else ASSETS_REFRESH_HOURS * 3600)
+    if cached_root:
+        st.info("Using cached assets ✅")
+        return cached_root
+    if ASSETS_OFFLINE:
+        raise ValueError(f"No cached assets in {ASSET_CACHE_DIR} and network access is disabled (ASSETS_OFFLINE=1).")
 
     # Agar local assets nahi hai to download kare
-    tmpdir = tempfile.mkdtemp()
     file_id = "17i5_V45rTM0SqSmhbgPrl4PTcqJNvVhS"
     url = f"https://drive.google.com/uc?id={file_id}"
-    zip_path = os.path.join(tmpdir, "assets.zip")
+    os.makedirs(ASSET_CACHE_DIR, exist_ok=True)
+    zip_path = os.path.join(ASSET_CACHE_DIR, ARCHIVE_NAME + ".part")
 
     try:
         st.info("assets Download Done ✅")
         gdown.download(url, zip_path, quiet=False)
-
-        # Verify the file is a valid ZIP
-        try:
-            with zipfile.ZipFile(zip_path, "r") as zip_ref:
-                zip_ref.testzip()  # Test ZIP integrity
-                zip_ref.extractall(tmpdir)
-        except zipfile.BadZipFile as e:
-            raise ValueError(f"Invalid ZIP file: {str(e)}")
-        finally:
-            if os.path.exists(zip_path):
-                os.remove(zip_path)
-
-        # Check for 'assets' folder or return tmpdir if structure differs
-        assets_path = os.path.join(tmpdir, "assets")
-        if os.path.exists(assets_path):
-            return assets_path
-        return tmpdir
+        return sync_archive(zip_path, ASSET_CACHE_DIR, keep_as=os.path.join(ASSET_CACHE_DIR, ARCHIVE_NAME))
 
     except Exception as e:
+        if os.path.exists(zip_path):
+            os.remove(zip_path)
+        stale_root = cached_assets_root(ASSET_CACHE_DIR)
+        if stale_root:
+            st.warning(f"Asset refresh failed ({str(e)}), using the cached copy.")
+            return stale_root
         st.error(f"Failed to download or extract assets: {str(e)}")
         st.error("Please ensure the Google Drive link is public and points to a valid ZIP file.")
         raise
 
+def get_assets_archive() -> str:
+    """The asset zip: ASSETS_ARCHIVE, the cached download while fresh (or offline), or a new download."""
+    if ASSETS_ARCHIVE:
+        return ASSETS_ARCHIVE
+    
+    archive_path = os.path.join(ASSET_CACHE_DIR, ARCHIVE_NAME)
+    if os.path.exists(archive_path):
+        age = datetime.now().timestamp() - os.stat(archive_path).st_mtime
+        if ASSETS_OFFLINE or age < ASSETS_REFRESH_HOURS * 3600:
+            return archive_path
+    if ASSETS_OFFLINE:
+        raise ValueError(f"No cached asset archive in {ASSET_CACHE_DIR} and network access is disabled (ASSETS_OFFLINE=1).")
+    
+    file_id = "17i5_V45rTM0SqSmhbgPrl4PTcqJNvVhS"
+    os.makedirs(ASSET_CACHE_DIR, exist_ok=True)
+    part_path = archive_path + ".part"
+    try:
+        gdown.download(f"https://drive.google.com/uc?id={file_id}", part_path, quiet=False)
+        with zipfile.ZipFile(part_path, "r"):
+            pass
+        os.replace(part_path, archive_path)
+    except Exception as e:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        if os.path.exists(archive_path):
+            st.warning(f"Asset refresh failed ({str(e)}), using the cached copy.")
+        else:
+            raise
+    return archive_path
+
 ASSETS_DIR = get_assets_dir()
 
+# ========== RENDER CACHES ==========
+def new_lru_cache(max_bytes: int) -> dict:
+    """Byte-budgeted LRU cache shared by all sessions of this process"""
+    return {
+        "entries": OrderedDict(),
+        "bytes": 0,
+        "max_bytes": max_bytes,
+        "hits": 0,
+        "misses": 0,
+        "evictions": 0,
+        "lock": threading.Lock()
+    }
+
+def lru_get(cache: dict, key):
+    with cache["lock"]:
+        entry = cache["entries"].get(key)
+        if entry is None:
+            cache["misses"] += 1
+            return None
+        cache["entries"].move_to_end(key)
+        cache["hits"] += 1
+        return entry[0]
+
+def _lru_evict(cache: dict):
+    while cache["bytes"] > cache["max_bytes"] and cache["entries"]:
+        _, (_, nbytes) = cache["entries"].popitem(last=False)
+        cache["bytes"] -= nbytes
+        cache["evictions"] += 1
+
+def lru_put(cache: dict, key, value, nbytes: int):
+    with cache["lock"]:
+        if nbytes > cache["max_bytes"]:
+            return
+        old = cache["entries"].pop(key, None)
+        if old is not None:
+            cache["bytes"] -= old[1]
+        cache["entries"][key] = (value, nbytes)
+        cache["bytes"] += nbytes
+        _lru_evict(cache)
+
+def lru_resize(cache: dict, max_bytes: int):
+    with cache["lock"]:
+        cache["max_bytes"] = max_bytes
+        _lru_evict(cache)
+
+def lru_clear(cache: dict):
+    with cache["lock"]:
+        cache["entries"].clear()
+        cache["bytes"] = 0
+        cache["hits"] = cache["misses"] = cache["evictions"] = 0
+
+def lru_stats(cache: dict) -> dict:
+    with cache["lock"]:
+        lookups = cache["hits"] + cache["misses"]
+        return {
+            "entries": len(cache["entries"]),
+            "bytes": cache["bytes"],
+            "max_bytes": cache["max_bytes"],
+            "hits": cache["hits"],
+            "misses": cache["misses"],
+            "evictions": cache["evictions"],
+            "hit_rate": cache["hits"] / lookups if lookups else 0.0
+        }
+
+@st.cache_resource
+def get_text_sprite_cache() -> dict:
+    budget_mb = _auth_load_settings().get("text_sprite_cache_mb", 64)
+    return new_lru_cache(budget_mb * 1024 * 1024)
+
+@st.cache_resource
+def get_gradient_cache() -> dict:
+    return new_lru_cache(32 * 1024 * 1024)
+
+@st.cache_resource
+def get_effect_mask_cache() -> dict:
+    return new_lru_cache(32 * 1024 * 1024)
+
+LAYOUT_CACHE_ENTRIES = 4096
+
+@st.cache_resource
+def get_layout_cache() -> dict:
+    # Entries are tiny, so the budget counts entries (each is put with size 1)
+    return new_lru_cache(LAYOUT_CACHE_ENTRIES)
+
+@st.cache_resource
+def get_background_cache() -> dict:
+    budget_mb = _auth_load_settings().get("background_cache_mb", 96)
+    return new_lru_cache(budget_mb * 1024 * 1024)
+
+@st.cache_resource
+def get_background_index() -> dict:
+    return {"signature": None, "files": [], "lock": threading.Lock()}
+
+OVERLAY_MEMBERS = ["1.png", "2.png", "3.png", "4.png", "5.png"]
+
+@st.cache_resource
+def get_theme_catalog_store() -> dict:
+    return {"signature": None, "catalog": None, "checked": 0.0, "lock": threading.Lock()}
+
+THEME_CATALOG_CHECK_SECONDS = 5  # how often the overlay folders are checked for changes
+
+def _theme_catalog_signature(root: str) -> Optional[tuple]:
+    """mtimes of the overlays folder, each year and theme folder, the manifest and the overlap settings file."""
+    try:
+        signature = [asset_version(root)]
+        for year in list_dir(root)[0]:
+            year_path = os.path.join(root, year)
+            signature.append((year, asset_version(year_path)))
+            # Adding or removing a PNG inside a theme only touches that theme's folder
+            signature += [(year, theme, asset_version(os.path.join(year_path, theme))) for theme in list_dir(year_path)[0]]
+    except OSError:
+        return None
+
+    # Suggested overlaps come from the manifest
+    signature.append(_asset_manifest_signature())
+    try:
+        signature.append(os.stat(OVERLAP_SETTINGS_FILE).st_mtime_ns)
+
+    except OSError:
+        signature.append(None)
+    return tuple(signature)
+
+def _scan_dir(path: str) -> Tuple[List[str], set]:
+    subfolders, files = list_dir(path)
+    return subfolders, set(files)
+
+def _build_theme_catalog(root: str) -> dict:
+    overlap_settings = _load_overlap_settings()
+    suggestions = get_asset_manifest().get("themes", {})
+    catalog = {}
+    for year in _scan_dir(root)[0]:
+        year_path = os.path.join(root, year)
+        themes, year_files = _scan_dir(year_path)
+        # A year folder without subfolders is itself the theme
+        candidates = [(t, os.path.join(year_path, t)) for t in themes] or [(year, year_path)]
+        entries = []
+        for theme, path in candidates:
+            files = year_files if path == year_path else _scan_dir(path)[1]
+            entries.append({
+                "year": year,
+                "theme": theme,
+                "path": path,
+                "members": [f for f in OVERLAY_MEMBERS if f in files],
+                "overlap": overlap_settings.get(f"{year}_{theme}"),
+                "suggested_overlap": suggestions.get(f"{year}_{theme}", {}).get("suggested_overlap")
+            })
+        catalog[year] = entries
+    return catalog
+
+def get_theme_catalog() -> dict:
+    """
+    Overlay themes by year, rebuilt only when the overlay folders or overlap settings change.
+    The folders are checked at most every THEME_CATALOG_CHECK_SECONDS, so a batch of variants
+    does not re-walk them.
+    """
+    store = get_theme_catalog_store()
+    now = time.monotonic()
+    with store["lock"]:
+        if store["catalog"] is not None and now - store["checked"] < THEME_CATALOG_CHECK_SECONDS:
+            return store["catalog"]
+    root = os.path.join(ASSETS_DIR, "overlays")
+    signature = _theme_catalog_signature(root)
+    with store["lock"]:
+        store["checked"] = now
+        if store["catalog"] is None or store["signature"] != signature:
+            if store["catalog"] is not None:
+                # Themes changed on disk, so cached overlay images may be stale
+                lru_clear(get_overlay_cache())
+            store["catalog"] = _build_theme_catalog(root) if signature else {}
+            store["signature"] = signature
+        return store["catalog"]
+
+@st.cache_resource
+def get_overlay_cache() -> dict:
+    budget_mb = _auth_load_settings().get("overlay_cache_mb", 256)
+    return new_lru_cache(budget_mb * 1024 * 1024)
+
+ASSET_MANIFEST_FILE = os.path.join("compiled", "manifest.json")
+
+@st.cache_resource
+def get_asset_manifest_store() -> dict:
+    return {"signature": None, "manifest": {}, "lock": threading.Lock()}
+
+def _asset_manifest_signature() -> Optional[tuple]:
+    try:
+        return asset_version(os.path.join(ASSETS_DIR, ASSET_MANIFEST_FILE))
+    except OSError:
+        return None
+
+def get_asset_manifest() -> dict:
+    """Manifest written by compile_assets.py, reloaded when it is recompiled, or an empty one when the pack is not compiled."""
+    store = get_asset_manifest_store()
+    signature = _asset_manifest_signature()
+    with store["lock"]:
+        if store["signature"] != signature:
+            try:
+                store["manifest"] = json.loads(read_asset(os.path.join(ASSETS_DIR, ASSET_MANIFEST_FILE)))
+            except Exception:
+                store["manifest"] = {}
+            if store["signature"] is not None:
+                # Compiled levels were rewritten, so cached overlay images may be stale
+                lru_clear(get_overlay_cache())
+            store["signature"] = signature
+        return store["manifest"]
+
+def _compiled_overlay(path: str) -> Optional[dict]:
+    """Manifest entry of an overlay, or None when it is not compiled or its source changed since."""
+    rel_path = os.path.relpath(path, ASSETS_DIR).replace(os.sep, "/")
+    info = get_asset_manifest().get("images", {}).get(rel_path)
+    if info is None:
+        return None
+    try:
+        version = list(asset_version(path))
+    except OSError:
+        return None
+    if version not in (info.get("version"), [info.get("crc"), info.get("bytes")]):
+        return None
+    return info
+
+ASSETS_BUNDLE = os.environ.get("ASSETS_BUNDLE")  # bundle written by compile_assets.py --bundle
+
+def asset_bundle_file() -> str:
+    if ASSETS_BUNDLE:
+        return ASSETS_BUNDLE
+    if is_archive_path(ASSETS_DIR):
+        return os.path.join(ASSET_CACHE_DIR, "assets.bundle")
+    return os.path.join(ASSETS_DIR, "compiled", "assets.bundle")
+
+@st.cache_resource
+def get_asset_bundle() -> Optional[dict]:
+    """Memory-mapped RGBA bundle shared by every process on the host, or None when not compiled."""
+    try:
+        return open_bundle(asset_bundle_file())
+    except (OSError, ValueError):
+        return None
+
+def decode_asset_image(path: str) -> Image.Image:
+    """
+    An asset image as RGBA. Served without decoding or copying from the mapped bundle while
+    its source file is unchanged, otherwise decoded from the file.
+    """
+    bundle = get_asset_bundle()
+    if bundle is not None:
+        key = os.path.relpath(path, ASSETS_DIR).replace(os.sep, "/")
+        entry = bundle["index"].get(key)
+        if entry is not None:
+            try:
+                version = list(asset_version(path))
+            except OSError:
+                version = None
+            if version in (entry["version"], [entry["crc"], entry["bytes"]]):
+                return bundle_image(bundle, key)
+    return Image.open(open_asset(path)).convert("RGBA")
+
+def _decode_overlay(path: str) -> Image.Image:
+    cache = get_overlay_cache()
+    img = lru_get(cache, ("decoded", path))
+    if img is None:
+        img = decode_asset_image(path)
+        lru_put(cache, ("decoded", path), img, img.width * img.height * 4)
+    return img
+
+def overlay_frame_size(path: str) -> Tuple[int, int]:
+    """Size of the overlay PNG as authored, before any alpha trimming."""
+    info = _compiled_overlay(path)
+    return tuple(info["size"]) if info else _decode_overlay(path).size
+
+def load_overlay(path: str, size: Optional[Tuple[int, int]] = None) -> Tuple[Image.Image, Tuple[int, int]]:
+    """
+    Overlay PNG scaled so its full frame is size, as (content, offset of the content in that frame).
+    With a compiled pack the content is alpha-trimmed and resampled from the nearest pyramid level.
+    Shared, so do not modify it.
+    """
+    cache = get_overlay_cache()
+    key = ("scaled", path, size)
+    cached = lru_get(cache, key)
+    if cached is not None:
+        return cached
+    
+    info = _compiled_overlay(path)
+    if info:
+        frame_w, frame_h = info["size"]
+        left, top, right, bottom = info["bbox"]
+        size = size or (frame_w, frame_h)
+        sx, sy = size[0] / frame_w, size[1] / frame_h
+        level = max(int(k) for k in info["levels"] if int(k) == 1 or int(k) <= 1 / max(sx, sy))
+        src = _decode_overlay(os.path.join(ASSETS_DIR, *info["levels"][str(level)].split("/")))
+        target = (max(1, round((right - left) * sx)), max(1, round((bottom - top) * sy)))
+        offset = (round(left * sx), round(top * sy))
+    else:
+        src = _decode_overlay(path)
+        target = size or src.size
+        offset = (0, 0)
+    
+    content = src if target == src.size else src.resize(target, Image.LANCZOS, reducing_gap=2.0)
+    # Unscaled content is already held by the decoded entry
+    lru_put(cache, key, (content, offset), 0 if content is src else target[0] * target[1] * 4)
+    return content, offset
+
+OVERLAY_STACK_VARIANTS = 4
+OVERLAY_STACK_JITTER = 20
+OVERLAY_WISH_GAP = 20
+
+def overlay_stack_files(greeting_type: str, show_wish: bool) -> List[str]:
+    if greeting_type == "Good Morning":
+        return ["1.png", "2.png"] + (["4.png"] if show_wish else [])
+    if greeting_type == "Good Night":
+        return ["1.png", "3.png"] + (["5.png"] if show_wish else [])
+    return []
+
+def get_overlay_stack(theme: dict, greeting_type: str, show_wish: bool, overlap_percent: int, png_size: float, 
+                      img_size: Tuple[int, int], variant: int = 0, layout_scale: float = 1.0) -> Optional[Tuple[Image.Image, int]]:
+    """
+    A theme's greeting PNGs stacked into one RGBA sprite, plus the y of its last layer.
+    Variant 0 is centred, the others jitter each layer sideways. layout_scale sizes the
+    wish gap and the jitter like the other layout spacing. Shared, so do not modify it.
+    """
+    files = [f for f in overlay_stack_files(greeting_type, show_wish) if f in theme["members"]]
+    main_files = [f for f in files if f in ["1.png", "2.png", "3.png"]]
+    wish_files = [f for f in files if f in ["4.png", "5.png"]]
+    if not files:
+        return None
+    frames = [overlay_frame_size(os.path.join(theme["path"], f)) for f in main_files + wish_files]
+    
+    # Overlaps shrink with the layers, the wish gap is a fixed number of output pixels
+    overlap = overlap_percent / 100 if len(main_files) >= 2 else 0
+    overlaps = len(main_files) - 1 if overlap else 0
+    wish_gap = int(round(OVERLAY_WISH_GAP * layout_scale)) if wish_files else 0
+    jitter = int(round(OVERLAY_STACK_JITTER * layout_scale))
+    source_h = sum(h for _, h in frames) - min(h for _, h in frames[:len(main_files)] or frames) * overlap * overlaps
+    max_w = max(w for w, _ in frames)
+    scale = min(png_size, (img_size[0] * 0.9) / max_w, max(1, img_size[1] * 0.9 - wish_gap) / source_h)
+    
+    cache = get_overlay_cache()
+    key = ("stack", theme["path"], greeting_type, show_wish, overlap_percent, round(scale, 4), variant, wish_gap, jitter)
+    cached = lru_get(cache, key)
+    if cached is not None:
+        return cached
+    
+    sizes = [(int(w * scale), int(h * scale)) for w, h in frames]
+    max_w = max(w for w, _ in sizes)
+    main_gap = -int(min(h for _, h in sizes[:len(main_files)] or sizes) * overlap)
+    gaps = [main_gap] * (len(sizes) - 1)
+    if wish_files:
+        gaps[-1] = wish_gap
+
+    rng = random.Random(variant)
+    layers = []
+    y = 0
+    for i, (f, size) in enumerate(zip(main_files + wish_files, sizes)):
+        offset = rng.randint(-jitter, jitter) if variant else 0
+        content, (ox, oy) = load_overlay(os.path.join(theme["path"], f), size)
+        layers.append((content, (max_w - size[0]) // 2 + offset + ox, y + oy))
+        if i < len(sizes) - 1:
+            y += size[1] + gaps[i]
+    
+    # The sprite only spans the layers' content, so transparent margins are never pasted
+    left = min(x for _, x, _ in layers)
+    top = min(ly for _, _, ly in layers)
+    width = max(x + p.width for p, x, _ in layers) - left
+    height = max(ly + p.height for p, _, ly in layers) - top
+    sprite = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+    for p, x, ly in layers:
+        sprite.alpha_composite(p, (x - left, ly - top))
+    
+    lru_put(cache, key, (sprite, y - top), width * height * 4)
+    return sprite, y - top
+
+def find_theme(year: str, theme: str) -> Optional[dict]:
+    for entry in get_theme_catalog().get(year, []):
+        if entry["theme"] == theme:
+            return entry
+    return None
+
+LUT_DIR = "luts"
+LUT_EXTENSIONS = [".cube"]
+
+@st.cache_resource
+def get_lut_cache() -> dict:
+    """Compiled Color3DLUT filters by file name, with the source version they were parsed from"""
+    return {"luts": {}, "errors": {}, "lock": threading.Lock()}
+
+def list_lut_presets() -> List[str]:
+    """.cube files in the assets luts folder"""
+    try:
+        _, files = list_dir(os.path.join(ASSETS_DIR, LUT_DIR))
+    except OSError:
+        return []
+    return [f for f in files if any(f.lower().endswith(ext) for ext in LUT_EXTENSIONS)]
+
+def lut_display_name(name: str) -> str:
+    return os.path.splitext(name)[0].replace("_", " ")
+
+def parse_cube_lut(data: bytes) -> ImageFilter.Color3DLUT:
+    """
+    Compile an Adobe/Resolve .cube 3D LUT into a PIL filter.
+    Only 3D tables over the default 0..1 domain are supported; anything else raises ValueError.
+    """
+    size = None
+    rows = []
+    for raw in data.decode("utf-8", "ignore").splitlines():
+        line = raw.strip()
+        if not line or line.startswith("#"):
+            continue
+        parts = line.split()
+        keyword = parts[0].upper()
+        if keyword == "LUT_3D_SIZE":
+            size = int(parts[1])
+        elif keyword == "LUT_1D_SIZE":
+            raise ValueError("1D LUTs are not supported")
+        elif keyword == "DOMAIN_MIN" and any(float(v) != 0.0 for v in parts[1:4]):
+            raise ValueError("only the default 0..1 domain is supported")
+        elif keyword == "DOMAIN_MAX" and any(float(v) != 1.0 for v in parts[1:4]):
+            raise ValueError("only the default 0..1 domain is supported")
+        elif keyword[0].isdigit() or keyword[0] in "-+.":
+            rows.append(line)
+    
+    if size is None:
+        raise ValueError("missing LUT_3D_SIZE")
+    table = np.array(" ".join(rows).split(), dtype=np.float32)
+    if table.size != size ** 3 * 3:
+        raise ValueError(f"expected {size ** 3} entries, found {table.size // 3}")
+    # .cube lists red fastest, then green, then blue, which is the order Color3DLUT expects
+    return ImageFilter.Color3DLUT(size, table, channels=3)
+
+def get_color_lut(name: str) -> Optional[ImageFilter.Color3DLUT]:
+    """A LUT preset parsed once and reused until its file changes, or None if it is missing or invalid."""
+    path = os.path.join(ASSETS_DIR, LUT_DIR, name)
+    try:
+        version = asset_version(path)
+    except OSError:
+        return None
+    
+    cache = get_lut_cache()
+    with cache["lock"]:
+        entry = cache["luts"].get(name)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+    
+    try:
+        lut = parse_cube_lut(read_asset(path))
+        error = None
+    except (ValueError, IndexError) as e:
+        lut, error = None, str(e)
+    with cache["lock"]:
+        cache["luts"][name] = (version, lut)
+        if error:
+            cache["errors"][name] = error
+        else:
+            cache["errors"].pop(name, None)
+    return lut
+
+WARMUP_TOP_OVERLAYS = 6
+WARMUP_TOP_BACKGROUNDS = 12
+WARMUP_USAGE_DAYS = 14
+
+@st.cache_resource
+def get_asset_usage_log() -> dict:
+    """Themes and backgrounds used since the last usage write, flushed to the usage DB in one go"""
+    return {"pending": [], "lock": threading.Lock()}
+
+@st.cache_resource
+def get_warmup_state() -> dict:
+    """Progress of the background warm-up that preloads fonts, themes and popular assets once per process"""
+    return {
+        "thread": None,
+        "plan": None,
+        "ready": threading.Event(),
+        "status": "pending",
+        "step": "",
+        "done": 0,
+        "total": 0,
+        "errors": [],
+        "started": None,
+        "finished": None,
+        "lock": threading.Lock()
+    }
+
+def _run_asset_warmup(state: dict):
+    # The steps are defined further down the script, which hands them over with publish_warmup_plan()
+    state["ready"].wait()
+    with state["lock"]:
+        state["started"] = datetime.now()
+    try:
+        steps = state["plan"]()
+    except Exception as e:
+        with state["lock"]:
+            state["status"] = "failed"
+            state["errors"].append(f"Planning: {str(e)}")
+            state["finished"] = datetime.now()
+        return
+    
+    with state["lock"]:
+        state["total"] = len(steps)
+    for label, step in steps:
+        with state["lock"]:
+            state["step"] = label
+        try:
+            step()
+        except Exception as e:
+            with state["lock"]:
+                state["errors"].append(f"{label}: {str(e)}")
+        with state["lock"]:
+            state["done"] += 1
+    
+    with state["lock"]:
+        state["status"] = "done"
+        state["step"] = ""
+        state["finished"] = datetime.now()
+
+def start_asset_warmup():
+    """
+    Preload the process-wide caches on a daemon thread, once per process. Nothing waits for it:
+    a generation that needs an asset before it is warm simply loads it itself.
+    """
+    state = get_warmup_state()
+    with state["lock"]:
+        if state["thread"] is not None:
+            return
+        state["status"] = "running"
+        thread = threading.Thread(target=_run_asset_warmup, args=(state,), name="asset-warmup", daemon=True)
+        # The steps go through st.cache_resource factories, which expect a script context;
+        # none of them draw anything, so the starting session's page is never touched
+        add_script_run_ctx(thread)
+        state["thread"] = thread
+        thread.start()
+
+start_asset_warmup()
+
+
 # ========== BEGIN AUTH / ADMIN BLOCK ==========
 DATA_DIR = "data"
 USERS_FILE = os.path.join(DATA_DIR, "users.json")
@@ -120,6 +695,12 @@ def init_db():
                   username TEXT,
                   image_count INTEGER,
                   timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS asset_usage
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  kind TEXT,
+                  name TEXT,
+                  detail TEXT,
+                  timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
     conn.commit()
     conn.close()
 
@@ -133,6 +714,43 @@ def log_image_usage(username, count):
     conn.commit()
     conn.close()
 
+def record_asset_use(kind, name, detail=None):
+    """Remember that a variant used an overlay theme or background; written by flush_asset_usage()."""
+    usage_log = get_asset_usage_log()
+    with usage_log["lock"]:
+        usage_log["pending"].append((kind, name, json.dumps(detail) if detail is not None else None))
+
+def flush_asset_usage():
+    usage_log = get_asset_usage_log()
+    with usage_log["lock"]:
+        rows, usage_log["pending"] = usage_log["pending"], []
+    if not rows:
+        return
+    conn = sqlite3.connect(DB_FILE)
+    c = conn.cursor()
+    c.executemany("INSERT INTO asset_usage (kind, name, detail) VALUES (?, ?, ?)", rows)
+    # Only the last WARMUP_USAGE_DAYS are ever read, so older rows are dropped
+    c.execute("DELETE FROM asset_usage WHERE timestamp < datetime('now', ?)", (f"-{int(WARMUP_USAGE_DAYS)} days",))
+    conn.commit()
+    conn.close()
+
+def get_popular_assets(kind, limit, days=WARMUP_USAGE_DAYS):
+    """Most used assets of a kind in the last days, each with its most common detail, busiest first."""
+    conn = sqlite3.connect(DB_FILE)
+    c = conn.cursor()
+    c.execute("""SELECT name, detail, COUNT(*) AS uses FROM asset_usage
+                 WHERE kind = ? AND timestamp >= datetime('now', ?)
+                 GROUP BY name, detail ORDER BY uses DESC""", (kind, f"-{int(days)} days"))
+    rows = c.fetchall()
+    conn.close()
+    
+    totals = Counter()
+    details = {}
+    for name, detail, uses in rows:
+        totals[name] += uses
+        details.setdefault(name, json.loads(detail) if detail else None)
+    return [(name, details[name]) for name, _ in totals.most_common(limit)]
+
 def get_usage_data():
     conn = sqlite3.connect(DB_FILE)
     df = pd.read_sql_query("SELECT * FROM image_usage ORDER BY timestamp DESC", conn)
@@ -216,6 +834,10 @@ def _save_overlap_settings(settings):
     os.makedirs(DATA_DIR, exist_ok=True)
     with open(OVERLAP_SETTINGS_FILE, "w") as f:
         json.dump(settings, f, indent=2)
+    # Saved overlaps show up on the next catalog lookup instead of after the check interval
+    store = get_theme_catalog_store()
+    with store["lock"]:
+        store["checked"] = 0.0
 
 def _load_tool_settings():
     try:
@@ -256,7 +878,8 @@ def _load_tool_settings():
                 "emoji": True,
                 "watermark": True,
                 "quote": True
-            }
+            },
+            "lut": {}
         }
 
 def _save_tool_settings(settings):
@@ -424,10 +1047,10 @@ if st.session_state.get("_auth_show_admin"):
     st.markdown("## ⚙️ ADMIN PANEL")
     
     st.markdown("### User Management")
-    tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8, tab9, tab10 = st.tabs([
+    tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8, tab9, tab10, tab11 = st.tabs([
         "User Accounts", "Access Control", "System Settings", "IP Management", 
         "Tools & Features", "Overlap Settings", "Tool Toggles", "Usage Statistics", 
-        "Tool Visibility", "Theme Preview"
+        "Tool Visibility", "Theme Preview", "Performance"
     ])
     
     with tab1:
@@ -657,32 +1280,27 @@ if st.session_state.get("_auth_show_admin"):
         st.markdown("Configure overlap percentages for different themes")
         
         # Get all available years and themes
-        overlay_years = list_subfolders(os.path.join(ASSETS_DIR, "overlays"))
-        all_themes = {}
-        
-        for year in overlay_years:
-            year_path = os.path.join(ASSETS_DIR, "overlays", year)
-            themes = list_subfolders(year_path)
-            if not themes:
-                # If no subfolders, use the year folder itself as a theme
-                all_themes[year] = [year]
-            else:
-                all_themes[year] = themes
+        theme_catalog = get_theme_catalog()
         
         # Create a nested structure for overlap settings
         overlap_settings = _load_overlap_settings()
         
-        for year, themes in all_themes.items():
+        for year, entries in theme_catalog.items():
             st.markdown(f"#### {year}")
-            for theme in themes:
+            for entry in entries:
+                theme = entry["theme"]
                 key = f"{year}_{theme}"
-                current_value = overlap_settings.get(key, 7)  # Default to 14
+                current_value = entry["overlap"] if entry["overlap"] is not None else 7  # Default to 14
+                suggested = entry["suggested_overlap"]
+                if entry["overlap"] is None and suggested is not None:
+                    current_value = suggested
                 new_value = st.slider(
                     f"{theme} overlap percentage", 
                     min_value=-15, 
                     max_value=50, 
                     value=current_value,
-                    key=f"overlap_{key}"
+                    key=f"overlap_{key}",
+                    help=f"Suggested from the compiled asset pack: {suggested}%" if suggested is not None else None
                 )
                 overlap_settings[key] = new_value
                 
@@ -741,6 +1359,23 @@ if st.session_state.get("_auth_show_admin"):
                     key=f"filter_{filt}"
                 )
         
+        st.markdown("#### Color Grading (LUT) Presets")
+        lut_presets = list_lut_presets()
+        if lut_presets:
+            lut_toggles = tool_settings.setdefault("lut", {})
+            col1, col2 = st.columns(2)
+            for i, name in enumerate(lut_presets):
+                with col1 if i % 2 == 0 else col2:
+                    lut_toggles[name] = st.checkbox(
+                        lut_display_name(name),
+                        value=lut_toggles.get(name, True),
+                        key=f"lut_{name}"
+                    )
+                    if get_color_lut(name) is None:
+                        st.caption(f"⚠️ Not usable: {get_lut_cache()['errors'].get(name, 'unreadable file')}")
+        else:
+            st.caption(f"Add .cube files to the {LUT_DIR} folder of the assets to offer them as presets")
+        
         st.markdown("#### Advanced Options")
         col1, col2 = st.columns(2)
         with col1:
@@ -841,16 +1476,8 @@ if st.session_state.get("_auth_show_admin"):
         st.markdown("Preview theme settings and test with your own images")
         
         # Get all available years and themes
-        overlay_years = list_subfolders(os.path.join(ASSETS_DIR, "overlays"))
-        all_themes = {}
-        
-        for year in overlay_years:
-            year_path = os.path.join(ASSETS_DIR, "overlays", year)
-            themes = list_subfolders(year_path)
-            if not themes:
-                all_themes[year] = [year]
-            else:
-                all_themes[year] = themes
+        theme_catalog = get_theme_catalog()
+        all_themes = {year: [e["theme"] for e in entries] for year, entries in theme_catalog.items()}
         
         # Create a compact form for theme selection
         col1, col2 = st.columns(2)
@@ -869,20 +1496,21 @@ if st.session_state.get("_auth_show_admin"):
         
         # Display theme preview
         if selected_year and selected_theme:
-            theme_path = os.path.join(ASSETS_DIR, "overlays", selected_year, selected_theme)
+            theme_entry = find_theme(selected_year, selected_theme)
             
-            if os.path.exists(theme_path):
+            if theme_entry is not None:
+                theme_path = theme_entry["path"]
                 st.markdown(f"### Preview for {selected_year} - {selected_theme}")
                 
                 # Display individual theme files
-                theme_files = list_files(theme_path, [".png", ".jpg", ".jpeg"])
+                theme_files = [os.path.join(theme_path, f) for f in theme_entry["members"]]
                 
                 if theme_files:
                     cols = st.columns(min(3, len(theme_files)))
-                    for i, file in enumerate(sorted(theme_files)):
+                    for i, file in enumerate(theme_files):
                         with cols[i % 3]:
                             try:
-                                img = Image.open(file)
+                                img = Image.open(open_asset(file))
                                 st.image(img, caption=os.path.basename(file), use_container_width=True)
                             except Exception as e:
                                 st.error(f"Error loading {os.path.basename(file)}: {str(e)}")
@@ -903,64 +1531,16 @@ if st.session_state.get("_auth_show_admin"):
                     
                     # Get overlap
                     overlap_key = f"{selected_year}_{selected_theme}"
-                    overlap_percent = _load_overlap_settings().get(overlap_key, 14)
-                    
-                    # Load PNGs based on greeting
-                    png_files = []
-                    if preview_greeting == "Good Morning":
-                        png_files = ["1.png", "2.png"]
-                        if preview_show_wish:
-                            png_files.append("4.png")
-                    elif preview_greeting == "Good Night":
-                        png_files = ["1.png", "3.png"]
-                        if preview_show_wish:
-                            png_files.append("5.png")
+                    overlap_percent = get_overlap_percentage(selected_year, selected_theme)
                     
-                    pngs = []
-                    for f in png_files:
-                        path = os.path.join(theme_path, f)
-                        if os.path.exists(path):
-                            png_img = Image.open(path).convert("RGBA")
-                            png_img._filename = f
-                            pngs.append(png_img)
+                    stack = get_overlay_stack(theme_entry, preview_greeting, preview_show_wish, overlap_percent, preview_png_size, img.size)
+
                     
-                    if pngs:
-                        # Layering
-                        main_pngs = [p for p in pngs if p._filename in ["1.png", "2.png", "3.png"]]
-                        wish_pngs = [p for p in pngs if p._filename in ["4.png", "5.png"]]
-                        
-                        main_pngs.sort(key=lambda x: 0 if x._filename == "1.png" else 1)
-                        
-                        pngs = main_pngs + wish_pngs
-                        
-                        # Gaps
-                        main_gap = -int(min([p.height for p in main_pngs]) * overlap_percent / 100) if len(main_pngs) >= 2 else 0
-                        wish_gap = 10
-                        
-                        gaps = [main_gap] * (len(pngs) - 1)
-                        if preview_show_wish and len(pngs) > len(main_pngs):
-                            gaps[-1] = wish_gap
-                        
-                        total_h = sum(p.height for p in pngs) + sum(gaps)
-                        max_w = max(p.width for p in pngs)
-                        
-                        scale = min(preview_png_size, min((img.width * 0.9) / max_w, (img.height * 0.9) / total_h))
-                        pngs = [p.resize((int(p.width * scale), int(p.height * scale)), Image.LANCZOS) for p in pngs]
-                        
-                        total_h = sum(p.height for p in pngs) + sum(gaps)
-                        max_w = max(p.width for p in pngs)
-                        
-                        start_y = (img.height - total_h) // 2
-                        start_x = (img.width - max_w) // 2
-                        
-                        current_y = start_y
-                        for i, p in enumerate(pngs):
-                            x = start_x + (max_w - p.width) // 2
-                            x = max(0, min(x, img.width - p.width))
-                            y = max(0, min(current_y, img.height - p.height))
-                            img.paste(p, (x, y), p)
-                            if i < len(pngs) - 1:
-                                current_y += p.height + gaps[i]
+                    if stack is not None:
+                        sprite = stack[0]
+                        start_x = (img.width - sprite.width) // 2
+                        start_y = max(0, (img.height - sprite.height) // 2)
+                        img.paste(sprite, (start_x, start_y), sprite)
                         
                         st.image(img, caption="Full Theme Preview with Overlap", use_container_width=True)
                         
@@ -982,6 +1562,96 @@ if st.session_state.get("_auth_show_admin"):
                 except Exception as e:
                     st.error(f"Error in preview: {str(e)}")
     
+    with tab11:
+        st.markdown("### Performance")
+        st.markdown("#### Text Sprite Cache")
+        st.caption("Finished text lines keyed by font, size, text, effect and colors")
+        
+        sprite_cache = get_text_sprite_cache()
+        stats = lru_stats(sprite_cache)
+        cols = st.columns(4)
+        cols[0].metric("Hits", stats["hits"])
+        cols[1].metric("Misses", stats["misses"])
+        cols[2].metric("Hit Rate", f"{stats['hit_rate'] * 100:.1f}%")
+        cols[3].metric("Evictions", stats["evictions"])
+        st.write(f"{stats['entries']} sprites | {stats['bytes'] / (1024 * 1024):.1f} MB of {stats['max_bytes'] / (1024 * 1024):.0f} MB")
+        
+        layout_stats = lru_stats(get_layout_cache())
+        st.write(f"Layout fits cached: {layout_stats['entries']} | Hits: {layout_stats['hits']} | Misses: {layout_stats['misses']}")
+        gradient_stats = lru_stats(get_gradient_cache())
+        st.write(f"Gradients cached: {gradient_stats['entries']} ({gradient_stats['bytes'] / (1024 * 1024):.1f} MB) | Hits: {gradient_stats['hits']} | Misses: {gradient_stats['misses']}")
+        mask_stats = lru_stats(get_effect_mask_cache())
+        st.write(f"Vignette masks cached: {mask_stats['entries']} ({mask_stats['bytes'] / (1024 * 1024):.1f} MB) | Hits: {mask_stats['hits']} | Misses: {mask_stats['misses']}")
+        asset_bundle = get_asset_bundle()
+        if asset_bundle is not None:
+            st.write(f"Asset bundle: {len(asset_bundle['index'])} images memory-mapped ({asset_bundle['bytes'] / (1024 * 1024):.1f} MB, shared across processes)")
+        else:
+            st.write("Asset bundle: not compiled (run `python compile_assets.py --bundle`)")
+        background_stats = lru_stats(get_background_cache())
+        st.write(f"Backgrounds in memory: {background_stats['entries']} ({background_stats['bytes'] / (1024 * 1024):.1f} MB of {background_stats['max_bytes'] / (1024 * 1024):.0f} MB) | Hits: {background_stats['hits']} | Misses: {background_stats['misses']}")
+        
+        sprite_budget = st.number_input("Text Sprite Cache Budget (MB)", min_value=8, max_value=2048, 
+                                        value=int(_settings.get("text_sprite_cache_mb", 64)), key="text_sprite_cache_mb")
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("Save Cache Budget"):
+                _settings["text_sprite_cache_mb"] = int(sprite_budget)
+                _auth_save_settings(_settings)
+                lru_resize(sprite_cache, int(sprite_budget) * 1024 * 1024)
+                st.success("Cache budget saved!")
+        with col2:
+            if st.button("Clear Text Sprite Cache"):
+                lru_clear(sprite_cache)
+                st.success("Text sprite cache cleared!")
+        
+        st.markdown("#### Overlay Image Cache")
+        st.caption("Decoded theme PNGs and their resized copies, keyed by file and target size")
+        
+        overlay_cache = get_overlay_cache()
+        overlay_stats = lru_stats(overlay_cache)
+        cols = st.columns(4)
+        cols[0].metric("Hits", overlay_stats["hits"])
+        cols[1].metric("Misses", overlay_stats["misses"])
+        cols[2].metric("Hit Rate", f"{overlay_stats['hit_rate'] * 100:.1f}%")
+        cols[3].metric("Evictions", overlay_stats["evictions"])
+        st.write(f"{overlay_stats['entries']} images | {overlay_stats['bytes'] / (1024 * 1024):.1f} MB of {overlay_stats['max_bytes'] / (1024 * 1024):.0f} MB")
+        
+        overlay_budget = st.number_input("Overlay Cache Budget (MB)", min_value=16, max_value=4096, 
+                                         value=int(_settings.get("overlay_cache_mb", 256)), key="overlay_cache_mb")
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("Save Overlay Cache Budget"):
+                _settings["overlay_cache_mb"] = int(overlay_budget)
+                _auth_save_settings(_settings)
+                lru_resize(overlay_cache, int(overlay_budget) * 1024 * 1024)
+                st.success("Overlay cache budget saved!")
+        with col2:
+            if st.button("Clear Overlay Cache"):
+                lru_clear(overlay_cache)
+                st.success("Overlay cache cleared!")
+        
+        st.markdown("#### Asset Warm-up")
+        st.caption(f"Fonts, the theme catalog and the themes and backgrounds most used in the last {WARMUP_USAGE_DAYS} days, "
+                   "preloaded once per process on a background thread")
+        
+        warmup = get_warmup_state()
+        with warmup["lock"]:
+            warmup_status = dict(warmup)
+        if warmup_status["started"] is None:
+            st.write("Waiting for a page load outside the admin panel to hand over the warm-up steps.")
+
+        else:
+            st.progress(warmup_status["done"] / warmup_status["total"] if warmup_status["total"] else 0.0)
+            if warmup_status["status"] == "running":
+                st.write(f"Running: {warmup_status['done']} of {warmup_status['total'] or '?'} steps"
+                         + (f" | Now: {warmup_status['step']}" if warmup_status["step"] else ""))
+            else:
+                elapsed = (warmup_status["finished"] - warmup_status["started"]).total_seconds()
+                st.write(f"Finished {warmup_status['done']} of {warmup_status['total']} steps in {elapsed:.1f}s "
+                         f"({warmup_status['finished'].strftime('%H:%M:%S')})")
+            for error in warmup_status["errors"]:
+                st.warning(error)
+    
     st.markdown("---")
     st.write("Contact developer: +91 9140588751")
     
@@ -1072,16 +1742,18 @@ st.markdown(f"""
 
 # =================== UTILS ===================
 def list_files(folder: str, exts: List[str]) -> List[str]:
-    if not os.path.exists(folder):
-        os.makedirs(folder, exist_ok=True)
+    if not asset_exists(folder):
+        if not is_archive_path(folder):
+            os.makedirs(folder, exist_ok=True)
         return []
-    return [f for f in os.listdir(folder) if any(f.lower().endswith(ext.lower()) for ext in exts)]
+    return [f for f in list_dir(folder)[1] if any(f.lower().endswith(ext.lower()) for ext in exts)]
 
 def list_subfolders(folder: str) -> List[str]:
-    if not os.path.exists(folder):
-        os.makedirs(folder, exist_ok=True)
+    if not asset_exists(folder):
+        if not is_archive_path(folder):
+            os.makedirs(folder, exist_ok=True)
         return []
-    return [d for d in os.listdir(folder) if os.path.isdir(os.path.join(folder, d))]
+    return list_dir(folder)[0]
 
 def get_text_size(draw: ImageDraw.Draw, text: str, font: ImageFont.FreeTypeFont) -> Tuple[int, int]:
     if text is None:
@@ -1089,17 +1761,253 @@ def get_text_size(draw: ImageDraw.Draw, text: str, font: ImageFont.FreeTypeFont)
     bbox = draw.textbbox((0, 0), text, font=font)
     return bbox[2] - bbox[0], bbox[3] - bbox[1]
 
+def measure_text(font: ImageFont.FreeTypeFont, text: str) -> Tuple[int, int]:
+    """Same box as get_text_size, without needing a draw context"""
+    bbox = font.getbbox(text)
+    return bbox[2] - bbox[0], bbox[3] - bbox[1]
+
+def _largest_fitting_size(fits, start_size: int, guess: int, min_size: int) -> int:
+    """Largest size in [min_size, start_size] for which fits(size) holds, checked around a predicted size"""
+    if fits(start_size):
+        return start_size
+    guess = max(min_size, min(start_size - 1, guess))
+    if fits(guess):
+        if guess + 1 >= start_size or not fits(guess + 1):
+            return guess
+        lo, hi = guess + 1, start_size - 1
+    else:
+        if guess <= min_size:
+            return min_size
+        lo, hi = min_size, guess - 1
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if fits(mid):
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+def _cached_layout(key, solve):
+    cache = get_layout_cache()
+    result = lru_get(cache, key)
+    if result is None:
+        result = solve()
+        lru_put(cache, key, result, 1)
+    return result
+
+def fit_text_size(font: ImageFont.FreeTypeFont, lines: List[str], max_width: float, start_size: int, min_size: int = 10) -> int:
+    """Largest font size <= start_size at which every line is at most max_width wide"""
+    max_width = int(max_width)
+    
+    def widest(size):
+        sized = get_sized_font(font, size)
+        return max(measure_text(sized, line)[0] for line in lines)
+    
+    def solve():
+        ref_width = widest(start_size)
+        if ref_width <= max_width:
+            return start_size
+        # Advance widths scale close to linearly with the font size
+        guess = int(start_size * max_width / ref_width)
+        return _largest_fitting_size(lambda size: widest(size) <= max_width, start_size, guess, min_size)
+    
+    face = font_face_key(font)
+    if face is None:
+        return solve()
+    key = ("fit", face, tuple(lines), max_width, int(start_size), min_size)
+    return _cached_layout(key, solve)
+
+GLYPH_TABLE_LIMIT = 256
+
+@st.cache_resource
+def get_glyph_tables() -> dict:
+    """Per (face, size) tables of glyph advance and ink box, filled lazily"""
+    return {"tables": OrderedDict(), "lock": threading.Lock()}
+
+def get_glyph_table(font: ImageFont.FreeTypeFont) -> dict:
+    tables = get_glyph_tables()
+    key = _font_cache_key(font)
+    if key is None:
+        return {}
+    with tables["lock"]:
+
+        table = tables["tables"].get(key)
+        if table is None:
+            table = {}
+            tables["tables"][key] = table
+            while len(tables["tables"]) > GLYPH_TABLE_LIMIT:
+                tables["tables"].popitem(last=False)
+        else:
+            tables["tables"].move_to_end(key)
+    return table
+
+def _glyph_metrics(font: ImageFont.FreeTypeFont, table: dict, ch: str) -> tuple:
+    metrics = table.get(ch)
+    if metrics is None:
+        left, top, right, bottom = font.getbbox(ch)
+        metrics = (font.getlength(ch), left, top, right, bottom)
+        table[ch] = metrics
+    return metrics
+
+def _segment_metrics(font: ImageFont.FreeTypeFont, table: dict, text: str) -> tuple:
+    """(advance, ink_left, ink_top, ink_right, ink_bottom) of a run, ink fields None when blank"""
+    segment = (0.0, None, None, None, None)
+    for ch in text:
+        segment = _join_segments(segment, _glyph_metrics(font, table, ch))
+    return segment
+
+def _join_segments(a: tuple, b: tuple) -> tuple:
+    adv_a, left_a, top_a, right_a, bottom_a = a
+    adv_b, left_b, top_b, right_b, bottom_b = b
+    if left_b is None or right_b <= left_b:
+        return (adv_a + adv_b, left_a, top_a, right_a, bottom_a)
+    if left_a is None:
+        return (adv_a + adv_b, adv_a + left_b, top_b, adv_a + right_b, bottom_b)
+    return (adv_a + adv_b, min(left_a, adv_a + left_b), min(top_a, top_b),
+            max(right_a, adv_a + right_b), max(bottom_a, bottom_b))
+
+def _segment_size(segment: tuple) -> Tuple[int, int]:
+    if segment[1] is None:
+        return 0, 0
+    return int(round(segment[3] - segment[1])), int(segment[4] - segment[2])
+
+def wrap_text(font: ImageFont.FreeTypeFont, text: str, max_width: float) -> List[Tuple[str, int, int]]:
+    """
+    Greedily wrap text on real glyph advances.
+    Returns (line, width, height) per line, with the same box get_text_size would report.
+    """
+    table = get_glyph_table(font)
+    space = _glyph_metrics(font, table, " ")
+    wrapped = []
+    line_words, line_segment = [], None
+    
+    def flush():
+        if line_words:
+            wrapped.append((" ".join(line_words), *_segment_size(line_segment)))
+    
+    for word in text.split():
+        word_segment = _segment_metrics(font, table, word)
+        if line_segment is not None:
+            candidate = _join_segments(_join_segments(line_segment, space), word_segment)
+            if _segment_size(candidate)[0] <= max_width:
+                line_words.append(word)
+                line_segment = candidate
+                continue
+            flush()
+        
+        if _segment_size(word_segment)[0] <= max_width:
+            line_words, line_segment = [word], word_segment
+            continue
+        
+        # Break words longer than the box, like textwrap's break_long_words
+        chunk, chunk_segment = "", (0.0, None, None, None, None)
+        for ch in word:
+            candidate = _join_segments(chunk_segment, _glyph_metrics(font, table, ch))
+            if chunk and _segment_size(candidate)[0] > max_width:
+                wrapped.append((chunk, *_segment_size(chunk_segment)))
+                chunk, candidate = "", _join_segments((0.0, None, None, None, None), _glyph_metrics(font, table, ch))
+            chunk += ch
+            chunk_segment = candidate
+        line_words, line_segment = [chunk], chunk_segment
+    
+    flush()
+    return wrapped
+
+def fit_wrapped_size(font: ImageFont.FreeTypeFont, text: str, max_width: float, start_size: int, max_lines: int = 3, min_size: int = 10) -> int:
+    """Largest font size <= start_size at which text wraps into at most max_lines lines"""
+    def fits(size):
+        return len(wrap_text(get_sized_font(font, size), text, max_width)) <= max_lines
+    
+    def solve():
+        full_width = measure_text(get_sized_font(font, start_size), text)[0]
+        guess = int(start_size * max_lines * max_width / max(1, full_width))
+        return _largest_fitting_size(fits, start_size, guess, min_size)
+    
+    face = font_face_key(font)
+    if face is None:
+        return solve()
+    key = ("wrap", face, text, int(max_width), int(start_size), max_lines, min_size)
+    return _cached_layout(key, solve)
+
+FONT_EXTENSIONS = [".ttf", ".otf"]
+BUNDLED_FONT_DIR = os.path.dirname(os.path.abspath(__file__))
+FONT_SIZE_CACHE_LIMIT = 512
+
+@st.cache_resource
+def get_font_registry() -> dict:
+    """Process-wide font faces (file bytes by path), memoized sized FreeTypeFont instances and their face keys"""
+    return {
+        "faces": {},
+        "folders": {},
+        "sized": OrderedDict(),
+        "keys": weakref.WeakKeyDictionary(),
+        "lock": threading.Lock()
+    }
+
+def register_font_folder(font_folder: str) -> List[str]:
+    """Scan a font folder once, keeping the bytes of every face that loads. Returns face keys."""
+    folder = os.path.abspath(font_folder)
+    registry = get_font_registry()
+    with registry["lock"]:
+        if folder in registry["folders"]:
+            return registry["folders"][folder]
+    
+    loaded = {}
+    for name in sorted(list_files(folder, FONT_EXTENSIONS)):
+        path = os.path.join(folder, name)
+        try:
+            data = read_asset(path)
+            ImageFont.truetype(io.BytesIO(data), 80)
+        except Exception:
+            continue
+        loaded[path] = data
+    
+    with registry["lock"]:
+        registry["faces"].update(loaded)
+        registry["folders"][folder] = list(loaded)
+        return registry["folders"][folder]
+
+def get_font(face_key: str, size: int) -> ImageFont.FreeTypeFont:
+    registry = get_font_registry()
+    key = (face_key, int(size))
+    with registry["lock"]:
+        font = registry["sized"].get(key)
+        if font is not None:
+            registry["sized"].move_to_end(key)
+            return font
+        data = registry["faces"][face_key]
+    
+    font = ImageFont.truetype(io.BytesIO(data), int(size))
+    with registry["lock"]:
+        registry["keys"][font] = face_key
+        registry["sized"][key] = font
+        while len(registry["sized"]) > FONT_SIZE_CACHE_LIMIT:
+            registry["sized"].popitem(last=False)
+    return font
+
+def font_face_key(font: ImageFont.FreeTypeFont) -> Optional[str]:
+    """Registry face key of a font from get_font, else its file path, else None when the face is unknown"""
+    registry = get_font_registry()
+    with registry["lock"]:
+        face_key = registry["keys"].get(font)
+    if face_key is None and isinstance(getattr(font, 'path', None), str):
+        face_key = font.path
+    return face_key
+
+def get_sized_font(font: ImageFont.FreeTypeFont, size: int) -> ImageFont.FreeTypeFont:
+    """Same face at another size; registry fonts are a dictionary hit instead of a re-parse"""
+    registry = get_font_registry()
+    with registry["lock"]:
+        face_key = registry["keys"].get(font)
+    if face_key is None:
+        return font.font_variant(size=size)
+    return get_font(face_key, size)
+
 def get_random_font(font_folder=os.path.join(ASSETS_DIR, "fonts")) -> ImageFont.FreeTypeFont:
     try:
-        fonts = list_files(font_folder, [".ttf", ".otf"])
-        if not fonts:
-            return ImageFont.truetype("arial.ttf", 80)
-        for _ in range(3):
-            try:
-                font_path = os.path.join(font_folder, random.choice(fonts))
-                return ImageFont.truetype(font_path, 80)
-            except:
-                continue
+        faces = register_font_folder(font_folder) or register_font_folder(BUNDLED_FONT_DIR)
+        if faces:
+            return get_font(random.choice(faces), 80)
         return ImageFont.truetype("arial.ttf", 80)
     except:
         return ImageFont.load_default()
@@ -1174,40 +2082,34 @@ def get_multi_gradient_colors() -> List[Tuple[int, int, int]]:
     num_colors = random.randint(2, 7)
     return [get_vibrant_color() for _ in range(num_colors)]
 
+def _gradient_ramp(length: int, colors: List[Tuple[int, int, int]]) -> np.ndarray:
+    """One row of a multi-stop gradient as a (length, 3) uint8 array"""
+    stops = np.asarray(colors, dtype=np.float32)[:, :3]
+    num_segments = len(stops) - 1
+    if num_segments < 1:
+        return np.repeat(stops[:1], length, axis=0).astype(np.uint8)
+    segment_len = max(1, length // num_segments)
+    pos = np.arange(length)
+    seg = np.minimum(pos // segment_len, num_segments - 1)
+    # The last segment absorbs the remainder instead of leaving it black
+    ratio = np.minimum((pos - seg * segment_len) / segment_len, 1.0)[:, None]
+    return (stops[seg] * (1 - ratio) + stops[seg + 1] * ratio).astype(np.uint8)
+
 def create_gradient_mask(width: int, height: int, colors: List[Tuple[int, int, int]], direction: str = 'horizontal') -> Image.Image:
-    gradient = Image.new('RGB', (width, height))
-    draw = ImageDraw.Draw(gradient)
-    
+    """Cached multi-stop gradient. The returned image is shared, so copy it before drawing on it."""
+    key = (width, height, tuple(tuple(c) for c in colors), direction)
+    cache = get_gradient_cache()
+    gradient = lru_get(cache, key)
+    if gradient is not None:
+        return gradient
+    
+    # Build a one-pixel strip and let a NEAREST resize replicate it across the frame
     if direction == 'vertical':
-        # For vertical gradient
-        num_segments = len(colors) - 1
-        segment_height = height // num_segments
-        for seg in range(num_segments):
-            start_color = colors[seg]
-            end_color = colors[seg + 1]
-            start_y = seg * segment_height
-            end_y = start_y + segment_height
-            for y in range(start_y, min(end_y, height)):
-                ratio = (y - start_y) / segment_height
-                r = int(start_color[0] * (1 - ratio) + end_color[0] * ratio)
-                g = int(start_color[1] * (1 - ratio) + end_color[1] * ratio)
-                b = int(start_color[2] * (1 - ratio) + end_color[2] * ratio)
-                draw.line([(0, y), (width, y)], fill=(r, g, b))
+        strip = _gradient_ramp(height, colors)[:, None, :]
     else:
-        num_segments = len(colors) - 1
-        segment_width = width // num_segments
-        for seg in range(num_segments):
-            start_color = colors[seg]
-            end_color = colors[seg + 1]
-            start_x = seg * segment_width
-            end_x = start_x + segment_width
-            for x in range(start_x, min(end_x, width)):
-                ratio = (x - start_x) / segment_width
-                r = int(start_color[0] * (1 - ratio) + end_color[0] * ratio)
-                g = int(start_color[1] * (1 - ratio) + end_color[1] * ratio)
-                b = int(start_color[2] * (1 - ratio) + end_color[2] * ratio)
-                draw.line([(x, 0), (x, height)], fill=(r, g, b))
-    
+        strip = _gradient_ramp(width, colors)[None, :, :]
+    gradient = Image.fromarray(np.ascontiguousarray(strip), 'RGB').resize((width, height), Image.NEAREST)
+    lru_put(cache, key, gradient, width * height * 3)
     return gradient
 
 def format_date(date_format: str = "%d %B %Y", show_day: bool = False) -> str:
@@ -1222,7 +2124,7 @@ def format_date(date_format: str = "%d %B %Y", show_day: bool = False) -> str:
 
 def apply_overlay(image: Image.Image, overlay_path: str, size: float = 0.5, position: Tuple[int, int] = None) -> Image.Image:
     try:
-        overlay = Image.open(overlay_path).convert("RGBA")
+        overlay = decode_asset_image(overlay_path)
         new_size = (int(image.width * size), int(image.height * size))
         overlay = overlay.resize(new_size, Image.LANCZOS)
         
@@ -1279,108 +2181,213 @@ def generate_filename(base_name="Picsart", time_option="current", custom_time=No
         future_time = now + timedelta(minutes=future_minutes)
         return f"{base_name}_{future_time.strftime('%y-%m-%d_%H-%M-%S')}.jpg"
 
-def get_watermark_position(img: Image.Image, watermark: Image.Image, occupied_boxes: List[Tuple[int, int, int, int]], padding: int = 10) -> Tuple[int, int]:
+def get_watermark_position(img: Image.Image, watermark: Image.Image, occupied_boxes: List[Tuple[int, int, int, int]], padding: int = 10, 
+                           margin: int = 20) -> Tuple[int, int]:
     ew, eh = watermark.size
     iw, ih = img.size
     possible_positions = [
-        (20, ih - eh - 20),
-        (iw - ew - 20, ih - eh - 20),
-        (20, 20),
-        (iw - ew - 20, 20),
-        ((iw - ew) // 2, ih - eh - 20)
+        (margin, ih - eh - margin),
+        (iw - ew - margin, ih - eh - margin),
+        (margin, margin),
+        (iw - ew - margin, margin),
+        ((iw - ew) // 2, ih - eh - margin)
     ]
     for pos in possible_positions:
         new_box = (pos[0], pos[1], ew, eh)
         if not any_overlap(new_box, occupied_boxes, padding):
             return pos
     # Fallback with more tries
-    return find_non_overlapping_position((iw, ih), (ew, eh), occupied_boxes, None, 100, padding)
+    return find_non_overlapping_position((iw, ih), (ew, eh), occupied_boxes, None, 100, padding, allow_overlap=True, label="watermark")
+
+LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114])
+SEPIA_MATRIX = np.array([
+    [.393, .769, .189],
+    [.349, .686, .168],
+    [.272, .534, .131]
+])
+
+def luma_mean(img: Image.Image, brightness: float = 1.0) -> float:
+    """Mean grey level ImageEnhance.Contrast would see after the brightness step, from one histogram"""
+    hist = np.array(img.convert('L').histogram(), dtype=np.float64)
+    levels = np.minimum(np.round(np.arange(256) * brightness), 255)
+    return float(int((hist * levels).sum() / max(hist.sum(), 1) + 0.5))
+
+def color_matrix(brightness=1.0, contrast=1.0, saturation=1.0, sepia=False, black_white=False, mean=128.0) -> np.ndarray:
+    """
+    Brightness, contrast, saturation, sepia and black & white folded into one 3x4 affine matrix,
+    in that order, with the same math as the ImageEnhance classes and the old tone filters.
+    """
+    grey = np.outer(np.ones(3), LUMA_WEIGHTS)
+    steps = [
+        (np.eye(3) * brightness, np.zeros(3)),
+        (np.eye(3) * contrast, np.full(3, (1 - contrast) * mean)),
+        (np.eye(3) * saturation + grey * (1 - saturation), np.zeros(3))
+    ]
+    if sepia:
+        steps.append((SEPIA_MATRIX, np.zeros(3)))
+    if black_white:
+        steps.append((grey, np.zeros(3)))
+    
+    matrix, offset = np.eye(3), np.zeros(3)
+    for step, step_offset in steps:
+        matrix, offset = step @ matrix, step @ offset + step_offset
+    return np.hstack([matrix, offset[:, None]])
 
-def enhance_image_quality(img: Image.Image, brightness=1.0, contrast=1.0, sharpness=1.0, saturation=1.0) -> Image.Image:
+def apply_color_matrix(img: Image.Image, matrix: np.ndarray) -> Image.Image:
     if img.mode != 'RGB':
         img = img.convert('RGB')
-        
-    img = ImageEnhance.Brightness(img).enhance(brightness)
-    img = ImageEnhance.Contrast(img).enhance(contrast)
-    img = ImageEnhance.Sharpness(img).enhance(sharpness)
-    img = ImageEnhance.Color(img).enhance(saturation)
+    if np.allclose(matrix, np.hstack([np.eye(3), np.zeros((3, 1))])):
+        return img
+    return img.convert('RGB', tuple(float(v) for v in matrix.ravel()))
+
+def enhance_image_quality(img: Image.Image, brightness=1.0, contrast=1.0, sharpness=1.0, saturation=1.0, 
+                          sepia=False, black_white=False) -> Image.Image:
+    """
+    All color adjustments and the sepia / black & white filters in a single pass over the pixels.
+    Contrast pivots on one precomputed mean; sharpening, the only spatial step, runs last and only when asked for.
+    """
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    
+    mean = luma_mean(img, brightness) if contrast != 1.0 else 128.0
+    img = apply_color_matrix(img, color_matrix(brightness, contrast, saturation, sepia, black_white, mean))
+    if sharpness != 1.0:
+        img = ImageEnhance.Sharpness(img).enhance(sharpness)
     
     return img
 
-def upscale_text_elements(img: Image.Image, scale_factor: int = 4) -> Image.Image:
-    if scale_factor > 1:
-        new_size = (img.width * scale_factor, img.height * scale_factor)
-        img = img.resize(new_size, Image.LANCZOS)
-    return img
+def fit_output_size(img: Image.Image, size: Tuple[int, int]) -> Image.Image:
+    """Resample a base image once to the output size, centre-cropping only if its aspect differs"""
+    if img.size == tuple(size):
+        return img
+    if abs(img.width * size[1] - img.height * size[0]) <= max(size):
+        return img.resize(size, Image.LANCZOS, reducing_gap=3.0)
+    return ImageOps.fit(img, size, Image.LANCZOS)
+
+def scale_boxes(boxes: List[Tuple[int, int, int, int]], sx: float, sy: float) -> List[Tuple[int, int, int, int]]:
+    return [(int(x * sx), int(y * sy), int(w * sx), int(h * sy)) for x, y, w, h in boxes]
+
+VIGNETTE_INTENSITY_STEP = 0.05
+
+def get_vignette_mask(size: Tuple[int, int], intensity: float) -> Image.Image:
+    """Radial vignette mask for a size, shared per intensity bucket. Shared, so do not modify it."""
+    bucket = round(round(intensity / VIGNETTE_INTENSITY_STEP) * VIGNETTE_INTENSITY_STEP, 2)
+    cache = get_effect_mask_cache()
+    key = ("vignette", tuple(size), bucket)
+    mask = lru_get(cache, key)
+    if mask is not None:
+        return mask
+    
+    width, height = size
+    x = np.linspace(-1, 1, width, dtype=np.float32)
+    y = np.linspace(-1, 1, height, dtype=np.float32)
+    R = np.sqrt(y[:, None] ** 2 + x[None, :] ** 2)
+    mask = Image.fromarray(((1 - np.clip(R * bucket, 0, 1)) * 255).astype(np.uint8))
+    lru_put(cache, key, mask, width * height)
+    return mask
 
 def apply_vignette(img: Image.Image, intensity: float = 0.8) -> Image.Image:
-    width, height = img.size
-    x = np.linspace(-1, 1, width)
-    y = np.linspace(-1, 1, height)
-    X, Y = np.meshgrid(x, y)
-    R = np.sqrt(X**2 + Y**2)
-    mask = 1 - np.clip(R * intensity, 0, 1)
-    mask = (mask * 255).astype(np.uint8)
-    mask_img = Image.fromarray(mask).convert('L')
-    vignette = Image.new('RGB', (width, height), (0, 0, 0))
-    img.paste(vignette, (0, 0), mask_img)
+    img.paste((0, 0, 0), (0, 0, img.width, img.height), get_vignette_mask(img.size, intensity))
     return img
 
 def apply_sepia(img: Image.Image) -> Image.Image:
-    arr = np.array(img)
-    sepia_filter = np.array([
-        [.393, .769, .189],
-        [.349, .686, .168],
-        [.272, .534, .131]
-    ])
-    arr = arr @ sepia_filter.T
-    arr = np.clip(arr, 0, 255)
-    return Image.fromarray(arr.astype('uint8'))
+    return apply_color_matrix(img, color_matrix(sepia=True))
 
 def apply_black_white(img: Image.Image) -> Image.Image:
-    return img.convert('L').convert('RGB')
+    return apply_color_matrix(img, color_matrix(black_white=True))
+
+GRAIN_TILE_SIZE = 256
+GRAIN_TILE_COUNT = 8
+
+@st.cache_resource
+def get_grain_tiles() -> List[Image.Image]:
+    """A small pool of film-grain tiles, drawn once per process and reused by every vintage image"""
+    rng = np.random.default_rng()
+    return [Image.fromarray(rng.normal(0, 25, (GRAIN_TILE_SIZE, GRAIN_TILE_SIZE, 3)).astype(np.int16).astype(np.uint8))
+            for _ in range(GRAIN_TILE_COUNT)]
+
+def grain_layer(size: Tuple[int, int]) -> Image.Image:
+    # Tile one random grain tile across the frame from a random phase, so the seams move every time
+    tile = random.choice(get_grain_tiles())
+    ox, oy = random.randrange(GRAIN_TILE_SIZE), random.randrange(GRAIN_TILE_SIZE)
+    layer = Image.new("RGB", size)
+    for y in range(-oy, size[1], GRAIN_TILE_SIZE):
+        for x in range(-ox, size[0], GRAIN_TILE_SIZE):
+            layer.paste(tile, (x, y))
+    return layer
 
 def apply_vintage(img: Image.Image) -> Image.Image:
     img = apply_sepia(img)
-    noise = np.random.normal(0, 25, img.size[::-1] + (3,)).astype(np.uint8)
-    noise_img = Image.fromarray(noise)
-    img = ImageChops.add(img, noise_img, scale=2.0)
+    img = ImageChops.add(img, grain_layer(img.size), scale=2.0)
     img = apply_vignette(img, 0.5)
     return img
 
-def apply_sketch_effect(img: Image.Image) -> Image.Image:
-    img_gray = img.convert('L')
-    img_invert = ImageOps.invert(img_gray)
-    img_blur = img_invert.filter(ImageFilter.GaussianBlur(radius=3))
-    return ImageOps.invert(img_blur)
-
-def apply_cartoon_effect(img: Image.Image) -> Image.Image:
-    reduced = img.quantize(colors=8, method=1)
-    gray = img.convert('L')
-    edges = gray.filter(ImageFilter.FIND_EDGES)
-    edges = edges.convert('L')
-    edges = edges.point(lambda x: 0 if x < 100 else 255)
-    cartoon = reduced.convert('RGB')
-    cartoon.paste((0, 0, 0), (0, 0), edges)
-    return cartoon
+EDGE_THRESHOLD = 100
+EDGE_LUT = [0] * EDGE_THRESHOLD + [255] * (256 - EDGE_THRESHOLD)
+CARTOON_COLORS = 8
+CARTOON_PALETTE_SIDE = 256
+
+def stylize_analysis(img: Image.Image) -> dict:
+    """Grayscale of a frame and, once a filter asks for it, its thresholded edge map; shared by the stylize filters"""
+    return {"gray": img.convert('L'), "ink": None}
+
+def _ink_edges(img: Image.Image, analysis: dict) -> Image.Image:
+    if analysis["ink"] is None:
+        analysis["ink"] = analysis["gray"].filter(ImageFilter.FIND_EDGES).point(EDGE_LUT)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    img.paste((0, 0, 0), (0, 0, img.width, img.height), analysis["ink"])
+    return img
+
+def quantize_colors(img: Image.Image, colors: int) -> Image.Image:
+    """Palette picked on a small copy, then mapped onto the full frame without dithering"""
+    small = img.copy()
+    small.thumbnail((CARTOON_PALETTE_SIDE, CARTOON_PALETTE_SIDE), Image.BILINEAR)
+    palette = small.quantize(colors=colors, method=Image.Quantize.MAXCOVERAGE)
+    return img.quantize(palette=palette, dither=Image.Dither.NONE)
+
+def apply_sketch_effect(img: Image.Image, analysis: Optional[dict] = None) -> Image.Image:
+    analysis = analysis or stylize_analysis(img)
+    # Same as inverting, blurring and inverting back, since the blur is linear
+    return analysis["gray"].filter(ImageFilter.GaussianBlur(radius=3))
+
+def apply_cartoon_effect(img: Image.Image, analysis: Optional[dict] = None) -> Image.Image:
+    analysis = analysis or stylize_analysis(img)
+    return _ink_edges(quantize_colors(img, CARTOON_COLORS).convert('RGB'), analysis)
 
 def apply_anime_effect(img: Image.Image) -> Image.Image:
-    img = ImageEnhance.Color(img).enhance(1.5)
-    edges = img.filter(ImageFilter.FIND_EDGES)
-    edges = edges.convert('L')
-    edges = edges.point(lambda x: 0 if x < 100 else 255)
-    result = img.copy()
-    result.paste((0, 0, 0), (0, 0), edges)
-    return result
+    img = apply_color_matrix(img, color_matrix(saturation=1.5))
+    # Edges of the saturated colour frame, so boundaries between equally bright hues are inked too
+    return _ink_edges(img, {"ink": img.filter(ImageFilter.FIND_EDGES).convert('L').point(EDGE_LUT)})
+
+def apply_stylize_filters(img: Image.Image, sketch: bool = False, cartoon: bool = False, anime: bool = False) -> Image.Image:
+    """
+    Chain the ticked stylize filters. Sketch and cartoon share one analysis of the incoming frame;
+    anime finds its edges on the frame it receives, after saturating it.
+    """
+    if not (sketch or cartoon or anime):
+        return img
+    analysis = stylize_analysis(img) if sketch or cartoon else None
+    if sketch:
+        img = apply_sketch_effect(img, analysis)
+    if cartoon:
+        img = apply_cartoon_effect(img, analysis)
+    if anime:
+        img = apply_anime_effect(img)
+    return img
+
 
-def apply_emoji_stickers(img: Image.Image, emojis: List[str], occupied_boxes: List[Tuple[int, int, int, int]], num_stickers=5, padding: int = 10) -> Image.Image:
+def apply_emoji_stickers(img: Image.Image, emojis: List[str], occupied_boxes: List[Tuple[int, int, int, int]], num_stickers=5, padding: int = 10, 
+                         sticker_size: int = 40) -> Image.Image:
     if not emojis:
         return img
     draw = ImageDraw.Draw(img)
-    font = ImageFont.truetype("arial.ttf", 40)
-    es = 40  # emoji size approx
+    font = ImageFont.truetype("arial.ttf", sticker_size)
+    es = sticker_size  # emoji size approx
     for _ in range(num_stickers):
-        pos = find_non_overlapping_position(img.size, (es, es), occupied_boxes, None, 100, padding)
+        pos = find_non_overlapping_position(img.size, (es, es), occupied_boxes, None, 100, padding, allow_overlap=False)
+        if pos is None:
+            break
         emoji = random.choice(emojis)
         draw.text(pos, emoji, font=font, fill=(255, 255, 0))
         occupied_boxes.append((pos[0], pos[1], es, es))
@@ -1400,191 +2407,386 @@ def get_dominant_color(img: Image.Image) -> Tuple[int, int, int]:
     r, g, b = colorsys.hls_to_rgb(h, l, s)
     return (int(r * 255), int(g * 255), int(b * 255))
 
+PLACEMENT_GRID = 4
+
+def build_placement_tables(img: Image.Image) -> dict:
+    """Summed-area tables of luminance and luminance squared, on a PLACEMENT_GRID px grid"""
+    lum = np.asarray(img.convert('L').reduce(PLACEMENT_GRID), dtype=np.float64)
+    sat = np.zeros((lum.shape[0] + 1, lum.shape[1] + 1))
+    sat2 = np.zeros_like(sat)
+    sat[1:, 1:] = lum.cumsum(0).cumsum(1)
+    sat2[1:, 1:] = (lum * lum).cumsum(0).cumsum(1)
+    return {"sat": sat, "sat2": sat2, "grid": PLACEMENT_GRID, "size": img.size}
+
+def _window_sums(sat: np.ndarray, bh: int, bw: int) -> np.ndarray:
+    # Sum of every bh x bw window, indexed by the window's top-left cell
+    return sat[bh:, bw:] - sat[:-bh, bw:] - sat[bh:, :-bw] + sat[:-bh, :-bw]
+
+def region_luminance(tables: dict, box: Tuple[int, int, int, int]) -> float:
+    """Mean luminance (0-255) under an (x, y, w, h) box in O(1)"""
+    sat, g = tables["sat"], tables["grid"]
+    rows, cols = sat.shape[0] - 1, sat.shape[1] - 1
+    x, y, w, h = box
+    x0, y0 = min(max(0, x // g), cols), min(max(0, y // g), rows)
+    x1, y1 = min(max(0, -(-(x + w) // g)), cols), min(max(0, -(-(y + h) // g)), rows)
+    area = (x1 - x0) * (y1 - y0)
+    if area <= 0:
+        return 128.0
+    return float(sat[y1, x1] - sat[y0, x1] - sat[y1, x0] + sat[y0, x0]) / area
+
+def find_calm_position(tables: dict, elem_size: Tuple[int, int], y_range: Tuple[int, int], 
+                       occupied: List[Tuple[int, int, int, int]], padding: int = 10, margin: int = 20, 
+                       tolerance: float = 30.0) -> Optional[Tuple[int, int]]:
+    """
+    Least busy top-left position for a box whose y lies in y_range and that clears the occupied boxes.
+    Every candidate on the grid is scored at once from the summed-area tables; positions within
+    tolerance of the calmest variance are picked at random so flat backgrounds still vary.
+    Returns None when nothing fits.
+    """
+    sat, sat2, g = tables["sat"], tables["sat2"], tables["grid"]
+    iw, ih = tables["size"]
+    w, h = elem_size
+    bw, bh = max(1, -(-w // g)), max(1, -(-h // g))
+    if bw > sat.shape[1] - 1 or bh > sat.shape[0] - 1:
+        return None
+    
+    area = bw * bh
+    mean = _window_sums(sat, bh, bw) / area
+    variance = _window_sums(sat2, bh, bw) / area - mean * mean
+    
+    xs = np.arange(variance.shape[1])[None, :] * g
+    ys = np.arange(variance.shape[0])[:, None] * g
+    if iw - w - 2 * margin < 0:
+        margin = 0
+    feasible = ((xs >= margin) & (xs <= iw - w - margin) & 
+                (ys >= max(0, y_range[0])) & (ys <= min(y_range[1], ih - h)))
+    for bx, by, bw_, bh_ in occupied:
+        feasible &= ~((xs > bx - w - 2 * padding) & (xs < bx + bw_ + 2 * padding) & 
+                      (ys > by - h - 2 * padding) & (ys < by + bh_ + 2 * padding))
+    if not feasible.any():
+        return None
+    
+    scores = np.where(feasible, variance, np.inf)
+    calm = np.argwhere(scores <= scores.min() + tolerance)
+    row, col = calm[random.randrange(len(calm))]
+    return int(col * g), int(row * g)
+
 def find_text_position(img: Image.Image, required_width: int, required_height: int, prefer_top: bool = True) -> Tuple[int, int]:
-    arr = np.array(img.convert('L'))
-    step = 20
-    min_var = float('inf')
-    best_pos = (20, 20 if prefer_top else img.height - required_height - 20)
-    start_y = 0 if prefer_top else img.height // 2
-    for y in range(start_y, img.height - required_height, step):
-        for x in range(0, img.width - required_width, step):
-            region = arr[y:y + required_height, x:x + required_width]
-            var = np.var(region)
-            if var < min_var:
-                min_var = var
-                best_pos = (x, y)
-    return best_pos
-
-def get_random_horizontal_position(img_width: int, text_width: int) -> int:
+    tables = build_placement_tables(img)
+    y_range = (0, img.height // 2) if prefer_top else (img.height // 2, img.height)
+    pos = find_calm_position(tables, (required_width, required_height), y_range, [], 0, 0, 0.0)
+    if pos is None:
+        return (20, 20 if prefer_top else img.height - required_height - 20)
+    return pos
+
+def readable_text_fill(backdrop_luma: float) -> Tuple[int, int, int]:
+    """White fill on dark or mid backdrops, near-black on very bright ones"""
+    return (255, 255, 255) if backdrop_luma < 190 else (35, 35, 35)
+
+def get_random_horizontal_position(img_width: int, text_width: int, margin: int = 20) -> int:
     positions = [
-        20,
+        margin,
         (img_width - text_width) // 2,
-        img_width - text_width - 20
+        img_width - text_width - margin
     ]
     return random.choice(positions)
 
-def apply_text_effect(draw: ImageDraw.Draw, position: Tuple[int, int], text: str, font: ImageFont.FreeTypeFont, 
-                      effect_settings: dict, base_img: Image.Image) -> dict:
-    x, y = position
+TEXT_EFFECT_TYPES = [
+    'white_only', 'white_black_outline_shadow', 'gradient',
+    'neon', 'rainbow', 'country_flag', '3d',
+    'white_color_outline_shadow', 'pure_color_white_outline',
+    'multicolor_gradient_outline', 'metallic', 'glowing'
+]
+
+TEXT_PURE_COLORS = [
+    (255, 0, 0), (255, 165, 0), (255, 255, 0), (0, 255, 0),
+    (0, 0, 255), (75, 0, 130), (238, 130, 238), (255, 192, 203)
+]
+
+# Effects whose colors are drawn from a continuous range; their sprites never repeat, so they bypass the cache
+UNCACHED_TEXT_EFFECTS = {'neon'}
+
+# Glow radius and peak alpha for the glow-based effects
+TEXT_GLOW_SETTINGS = {
+    'neon': (10, 80),
+    'glowing': (15, 100)
+}
+
+def resolve_text_style(effect_settings: dict) -> dict:
+    """Pick the concrete effect type and colors for one text line"""
     effect_type = effect_settings['type']
-    
-    if text is None or text.strip() == "":
-        return effect_settings
-    
-    text_width, text_height = get_text_size(draw, text, font)
-    
     if effect_type == 'random':
-        available_effects = [
-            'white_only', 'white_black_outline_shadow', 'gradient', 
-            'neon', 'rainbow', 'country_flag', '3d',
-            'white_color_outline_shadow', 'pure_color_white_outline',
-            'multicolor_gradient_outline', 'metallic', 'glowing'
-        ]
-        effect_type = random.choice(available_effects)
+        effect_type = random.choice(TEXT_EFFECT_TYPES)
         effect_settings['type'] = effect_type
     
-    shadow_layer = Image.new('RGBA', base_img.size, (0, 0, 0, 0))
-    outline_layer = Image.new('RGBA', base_img.size, (0, 0, 0, 0))
-    fill_layer = Image.new('RGBA', base_img.size, (0, 0, 0, 0))
-    
-    shadow_draw = ImageDraw.Draw(shadow_layer)
-    outline_draw = ImageDraw.Draw(outline_layer)
-    fill_draw = ImageDraw.Draw(fill_layer)
-    
-    shadow_offset = (2, 2)
-    shadow_draw.text((x + shadow_offset[0], y + shadow_offset[1]), text, font=font, fill=(0, 0, 0, 40))
-    
-    pure_colors = [
-        (255, 0, 0), (255, 165, 0), (255, 255, 0), (0, 255, 0),
-        (0, 0, 255), (75, 0, 130), (238, 130, 238), (255, 192, 203)
-    ]
-    
-    outline_range = 1 if effect_type == 'neon' else 2
+    style = {'type': effect_type}
+    if effect_settings.get('scale', 1.0) != 1.0:
+        style['scale'] = round(effect_settings['scale'], 3)
+    if effect_type == 'white_only' and 'backdrop_luma' in effect_settings:
+        style['fill_color'] = readable_text_fill(effect_settings['backdrop_luma'])
+    elif effect_type == 'white_color_outline_shadow':
+        style['outline_color'] = random.choice(TEXT_PURE_COLORS)
+    elif effect_type == 'pure_color_white_outline':
+        style['fill_color'] = random.choice(TEXT_PURE_COLORS)
+    elif effect_type == 'multicolor_gradient_outline':
+        style['colors'] = tuple(random.choice(TEXT_PURE_COLORS) for _ in range(random.randint(2, 4)))
+    elif effect_type == 'metallic':
+        style['fill_color'] = random.choice([(192, 192, 192), (169, 169, 169), (211, 211, 211), (105, 105, 105)])
+    elif effect_type == 'glowing':
+        style['glow_color'] = random.choice(TEXT_PURE_COLORS)
+    elif effect_type == 'neon':
+        style['glow_color'] = get_vibrant_color()
+    elif effect_type in ['gradient', 'rainbow']:
+        style['colors'] = tuple(tuple(c) for c in effect_settings['colors'])
+    elif effect_type == 'country_flag':
+        flags = list(get_flag_atlas())
+        style['flag'] = random.choice(flags) if flags else None
+    return style
+
+FLAG_MAX_SIDE = 1024
+FLAG_MIN_LEVEL_SIDE = 48
+
+@st.cache_resource
+def get_flag_atlas() -> dict:
+    """Every flag decoded once, as a pyramid of RGB levels from largest to smallest"""
+    atlas = {}
+    flag_folder = os.path.join(ASSETS_DIR, "flags")
+    for name in sorted(list_files(flag_folder, [".png", ".jpg"])):
+        try:
+            flag = decode_asset_image(os.path.join(flag_folder, name)).convert("RGB")
+        except Exception:
+            continue
+        flag.thumbnail((FLAG_MAX_SIDE, FLAG_MAX_SIDE), Image.LANCZOS)
+        levels = [flag]
+        while min(levels[-1].size) >= 2 * FLAG_MIN_LEVEL_SIDE:
+            levels.append(levels[-1].reduce(2))
+        atlas[name] = levels
+    return atlas
+
+def get_flag_texture(name: str, size: Tuple[int, int]) -> Image.Image:
+    """Resize from the smallest pre-scaled level that still covers the requested size"""
+    levels = get_flag_atlas()[name]
+    source = levels[0]
+    for level in levels:
+        if level.width >= size[0] and level.height >= size[1]:
+            source = level
+    return source.resize(size, Image.LANCZOS)
+
+def render_glyph_mask(text: str, font: ImageFont.FreeTypeFont, pad: int) -> Tuple[Image.Image, Tuple[int, int]]:
+    """
+    Rasterize the glyph coverage of one line once.
+    Returns the padded "L" mask and its offset from the draw.text position.
+    """
+    left, top, right, bottom = font.getbbox(text)
+    mask = Image.new("L", (right - left + 2 * pad, bottom - top + 2 * pad), 0)
+    ImageDraw.Draw(mask).text((pad - left, pad - top), text, font=font, fill=255)
+    return mask, (left - pad, top - pad)
+
+def _scale_mask(mask: Image.Image, opacity: int) -> Image.Image:
+    if opacity >= 255:
+        return mask
+    return mask.point([v * opacity // 255 for v in range(256)])
+
+def _color_layer(mask: Image.Image, color: Tuple[int, ...], opacity: int = 255) -> Image.Image:
+    layer = Image.new("RGBA", mask.size, tuple(color[:3]) + (0,))
+    layer.putalpha(_scale_mask(mask, opacity))
+    return layer
+
+def _paint(layer: Image.Image, mask: Image.Image, color: Tuple[int, ...]):
+    # Same blending as draw.text with this fill on an existing RGBA layer
+    layer.paste(tuple(color), (0, 0, layer.width, layer.height), mask)
+
+def _texture_layer(mask: Image.Image, texture: Image.Image, pad: int) -> Image.Image:
+    layer = Image.new("RGBA", mask.size, (0, 0, 0, 0))
+    layer.paste(texture.convert("RGB"), (pad, pad))
+    layer.putalpha(mask)
+    return layer
+
+def _dilate_mask(mask: Image.Image, radius: int) -> Image.Image:
+    # Square dilation, same footprint as drawing the text at every (ox, oy) offset.
+    # Repeated 3x3 passes give the same result as one wide MaxFilter at a fraction of the cost
+    for _ in range(radius):
+        mask = mask.filter(ImageFilter.MaxFilter(3))
+    return mask
+
+def _glow_mask(mask: Image.Image, radius: int, peak_alpha: int) -> Image.Image:
+    # Blur pyramid: spread the glyphs on a reduced copy, then scale back up.
+    # Dilating by ceil(radius / factor) there keeps the full-size footprint at the configured radius
+    factor = max(1, radius // 5)
+    small = mask.reduce(factor) if factor > 1 else mask
+    small_radius = max(2, math.ceil(radius / factor))
+    small = _dilate_mask(small, small_radius)
+
+    small = small.filter(ImageFilter.GaussianBlur(small_radius / 3))
+    glow = small.resize(mask.size, Image.BILINEAR) if factor > 1 else small
+    return _scale_mask(glow, peak_alpha)
+
+def _extrude_mask(mask: Image.Image, depth: int) -> Image.Image:
+    extruded = mask
+    for i in range(1, depth):
+        extruded = ImageChops.lighter(extruded, ImageChops.offset(mask, i, i))
+    return extruded
+
+def _effect_px(value: int, scale: float) -> int:
+    return max(1, int(round(value * scale)))
+
+def _text_effect_padding(effect_type: str, scale: float = 1.0) -> int:
+    if effect_type in TEXT_GLOW_SETTINGS:
+        return _effect_px(TEXT_GLOW_SETTINGS[effect_type][0], scale) * 2
+    if effect_type == '3d':
+        return _effect_px(6, scale)
+    return _effect_px(4, scale)
+
+def build_text_layers(text: str, font: ImageFont.FreeTypeFont, style: dict) -> Tuple[Image.Image, Image.Image, Image.Image, Tuple[int, int]]:
+    """
+    Build the shadow, outline and fill layers of one line from a single glyph mask.
+    All layers share the mask size; the returned offset is relative to the draw.text position.
+    Shadow, outline, glow and extrusion widths grow with style['scale'] on larger canvases.
+    """
+    effect_type = style['type']
+    scale = style.get('scale', 1.0)
+    pad = _text_effect_padding(effect_type, scale)
+    mask, origin = render_glyph_mask(text, font, pad)
+    ink_size = (mask.width - 2 * pad, mask.height - 2 * pad)
+    empty = Image.new("RGBA", mask.size, (0, 0, 0, 0))
+    white = (255, 255, 255)
+    
+    shadow_offset = _effect_px(2, scale)
+    shadow_layer = _color_layer(ImageChops.offset(mask, shadow_offset, shadow_offset), (0, 0, 0), 40)
+    outline_layer = empty
+    outline_range = _effect_px(1 if effect_type == 'neon' else 2, scale)
     
     if effect_type == 'white_color_outline_shadow':
-        outline_color = random.choice(pure_colors)
-        for ox in range(-outline_range, outline_range + 1):
-            for oy in range(-outline_range, outline_range + 1):
-                if ox != 0 or oy != 0:
-                    outline_draw.text((x + ox, y + oy), text, font=font, fill=outline_color)
-        fill_draw.text((x, y), text, font=font, fill=(255, 255, 255, 255))
+        outline_layer = _color_layer(_dilate_mask(mask, outline_range), style['outline_color'])
+        fill_layer = _color_layer(mask, white)
     
     elif effect_type == 'pure_color_white_outline':
-        text_color = random.choice(pure_colors)
-        for ox in range(-outline_range, outline_range + 1):
-            for oy in range(-outline_range, outline_range + 1):
-                if ox != 0 or oy != 0:
-                    outline_draw.text((x + ox, y + oy), text, font=font, fill=(255, 255, 255, 255))
-        fill_draw.text((x, y), text, font=font, fill=text_color)
+        outline_layer = _color_layer(_dilate_mask(mask, outline_range), white)
+        fill_layer = _color_layer(mask, style['fill_color'])
     
     elif effect_type == 'multicolor_gradient_outline':
-        colors = [random.choice(pure_colors) for _ in range(random.randint(2, 4))]
-        gradient = create_gradient_mask(text_width, text_height, colors)
-        mask = Image.new("L", (text_width, text_height), 0)
-        mask_draw = ImageDraw.Draw(mask)
-        mask_draw.text((0, 0), text, font=font, fill=255)
-        gradient_text = Image.new("RGBA", (text_width, text_height), (0, 0, 0, 0))
-        gradient_text.paste(gradient, (0, 0), mask)
-        
-        for ox in range(-outline_range, outline_range + 1):
-            for oy in range(-outline_range, outline_range + 1):
-                if ox != 0 or oy != 0:
-                    outline_draw.text((x + ox, y + oy), text, font=font, fill=(0, 0, 0, 255))
-        
-        fill_layer.paste(gradient_text, (x, y), gradient_text)
+        outline_layer = _color_layer(_dilate_mask(mask, outline_range), (0, 0, 0))
+        gradient = create_gradient_mask(ink_size[0], ink_size[1], list(style['colors']))
+        fill_layer = _texture_layer(mask, gradient, pad)
     
     elif effect_type == 'metallic':
-        metallic_colors = [(192, 192, 192), (169, 169, 169), (211, 211, 211), (105, 105, 105)]
-        base_color = random.choice(metallic_colors)
-        highlight_color = (255, 255, 255, 180)
-        
-        fill_draw.text((x, y), text, font=font, fill=base_color)
-        
-        fill_draw.text((x-1, y-1), text, font=font, fill=highlight_color)
+        fill_layer = _color_layer(mask, style['fill_color'])
+        highlight = _effect_px(1, scale)
+        _paint(fill_layer, ImageChops.offset(mask, -highlight, -highlight), (255, 255, 255, 180))
     
     elif effect_type == 'glowing':
-        glow_color = random.choice(pure_colors)
-        glow_size = 15
-        for i in range(glow_size, 0, -2):
-            alpha = int(100 * (i / glow_size))
-            for ox in range(-i, i + 1, 2):
-                for oy in range(-i, i + 1, 2):
-                    if ox != 0 or oy != 0:
-                        fill_draw.text((x + ox, y + oy), text, font=font, fill=(*glow_color, alpha))
-        fill_draw.text((x, y), text, font=font, fill=(255, 255, 255, 255))
+        radius, peak_alpha = TEXT_GLOW_SETTINGS['glowing']
+        radius = _effect_px(radius, scale)
+        fill_layer = _color_layer(_glow_mask(mask, radius, peak_alpha), style['glow_color'])
+        _paint(fill_layer, mask, (255, 255, 255, 255))
     
     else:
-        for ox in range(-outline_range, outline_range + 1):
-            for oy in range(-outline_range, outline_range + 1):
-                if ox != 0 or oy != 0:
-                    outline_draw.text((x + ox, y + oy), text, font=font, fill=(0, 0, 0, 255))
-        
-        mask = Image.new("L", (text_width, text_height), 0)
-        mask_draw = ImageDraw.Draw(mask)
-        mask_draw.text((0, 0), text, font=font, fill=255)
+        outline_layer = _color_layer(_dilate_mask(mask, outline_range), (0, 0, 0))
         
         if effect_type in ['gradient', 'rainbow']:
-            colors = effect_settings['colors']
-            gradient = create_gradient_mask(text_width, text_height, colors)
-            gradient_text = Image.new("RGBA", (text_width, text_height), (0, 0, 0, 0))
-            gradient_text.paste(gradient, (0, 0), mask)
-            fill_layer.paste(gradient_text, (x, y), gradient_text)
+            gradient = create_gradient_mask(ink_size[0], ink_size[1], list(style['colors']))
+            fill_layer = _texture_layer(mask, gradient, pad)
         
         elif effect_type == 'neon':
-            glow_color = get_vibrant_color()
-            glow_size = 10
-            for i in range(glow_size, 0, -1):
-                alpha = int(80 * (i / glow_size))
-                for ox in range(-i, i + 1):
-                    for oy in range(-i, i + 1):
-                        if ox != 0 or oy != 0:
-                            fill_draw.text((x + ox, y + oy), text, font=font, fill=(*glow_color, alpha))
-            fill_draw.text((x, y), text, font=font, fill=(255, 255, 255, 255))
-        
-        elif effect_type == 'country_flag':
-            flags = list_files(os.path.join(ASSETS_DIR, "flags"), [".png", ".jpg"])
-            if flags:
-                flag_path = os.path.join(ASSETS_DIR, "flags", random.choice(flags))
-                flag_img = Image.open(flag_path).convert("RGB").resize((text_width, text_height), Image.LANCZOS)
-                flag_text = Image.new("RGBA", (text_width, text_height), (0, 0, 0, 0))
-                flag_text.paste(flag_img, (0, 0), mask)
-                fill_layer.paste(flag_text, (x, y), flag_text)
-            else:
-                fill_draw.text((x, y), text, font=font, fill=(255, 255, 255, 255))
+            radius, peak_alpha = TEXT_GLOW_SETTINGS['neon']
+            radius = _effect_px(radius, scale)
+            fill_layer = _color_layer(_glow_mask(mask, radius, peak_alpha), style['glow_color'])
+            _paint(fill_layer, mask, (255, 255, 255, 255))
+        
+        elif effect_type == 'country_flag' and style.get('flag'):
+            fill_layer = _texture_layer(mask, get_flag_texture(style['flag'], ink_size), pad)
         
         elif effect_type == '3d':
-            depth = 5
-            shadow_color = (100, 100, 100, 255)
-            for i in range(depth):
-                fill_draw.text((x + i, y + i), text, font=font, fill=shadow_color)
-            fill_draw.text((x, y), text, font=font, fill=(255, 255, 255, 255))
+            fill_layer = _color_layer(_extrude_mask(mask, _effect_px(5, scale)), (100, 100, 100))
+            _paint(fill_layer, mask, (255, 255, 255, 255))
         
         else:
-            fill_draw.text((x, y), text, font=font, fill=(255, 255, 255, 255))
+            fill_layer = _color_layer(mask, style.get('fill_color', white))
     
-    base_img_rgba = base_img.convert('RGBA') if base_img.mode != 'RGBA' else base_img
-    base_img_rgba = Image.alpha_composite(base_img_rgba, shadow_layer)
-    base_img_rgba = Image.alpha_composite(base_img_rgba, outline_layer)
-    base_img_rgba = Image.alpha_composite(base_img_rgba, fill_layer)
+    return shadow_layer, outline_layer, fill_layer, origin
+
+def render_text_sprite(text: str, font: ImageFont.FreeTypeFont, style: dict) -> Tuple[Image.Image, Tuple[int, int]]:
+    """
+    Flatten the shadow, outline and fill layers of one line into a single padded RGBA sprite.
+    The offset is relative to the top-left of the line's ink box, which is the box create_variant lays out.
+    Note: anchoring on the ink box rather than the draw.text origin moves every line up and left by the
+    font's bearing compared with plain draw.text, so the drawn glyphs land inside their occupied box.
+    """
+    shadow_layer, outline_layer, fill_layer, (ox, oy) = build_text_layers(text, font, style)
+    sprite = Image.alpha_composite(shadow_layer, outline_layer)
+    sprite.alpha_composite(fill_layer)
+    left, top = font.getbbox(text)[:2]
+    return sprite, (ox - left, oy - top)
+
+def _font_cache_key(font: ImageFont.FreeTypeFont) -> Optional[tuple]:
+    """Cache key for a face at its size, or None for fonts that cannot be told apart and must not be cached"""
+    face = font_face_key(font)
+    if face is None:
+        return None
+    return (face, getattr(font, 'index', 0), getattr(font, 'size', None))
+
+def get_text_sprite(text: str, font: ImageFont.FreeTypeFont, style: dict) -> Tuple[Image.Image, Tuple[int, int]]:
+    """Cached render_text_sprite; sprites are shared and must not be modified by callers"""
+    font_key = _font_cache_key(font)
+    if font_key is None or style['type'] in UNCACHED_TEXT_EFFECTS:
+        return render_text_sprite(text, font, style)
+
     
-    base_img.paste(base_img_rgba, (0, 0))
+    cache = get_text_sprite_cache()
+    key = (font_key, text, tuple(sorted(style.items())))
+    cached = lru_get(cache, key)
+    if cached is not None:
+        return cached
+    
+    sprite, origin = render_text_sprite(text, font, style)
+    lru_put(cache, key, (sprite, origin), sprite.width * sprite.height * 4)
+    return sprite, origin
+
+def composite_sprite(base_img: Image.Image, sprite: Image.Image, position: Tuple[int, int]) -> None:
+    """Alpha-composite an RGBA sprite into base_img in place, touching only the region under it"""
+    x, y = position
+    left, top = max(0, x), max(0, y)
+    right, bottom = min(base_img.width, x + sprite.width), min(base_img.height, y + sprite.height)
+    if right <= left or bottom <= top:
+        return
+    if (left, top, right, bottom) != (x, y, x + sprite.width, y + sprite.height):
+        sprite = sprite.crop((left - x, top - y, right - x, bottom - y))
+    
+    if base_img.mode == 'RGBA':
+        base_img.alpha_composite(sprite, (left, top))
+    else:
+        region = base_img.crop((left, top, right, bottom)).convert('RGBA')
+        region.alpha_composite(sprite)
+        base_img.paste(region.convert(base_img.mode), (left, top))
+
+def apply_text_effect(draw: ImageDraw.Draw, position: Tuple[int, int], text: str, font: ImageFont.FreeTypeFont, 
+                      effect_settings: dict, base_img: Image.Image) -> dict:
+    x, y = position
+    
+    if text is None or text.strip() == "":
+        return effect_settings
+    
+    style = resolve_text_style(effect_settings)
+    sprite, (ox, oy) = get_text_sprite(text, font, style)
+    composite_sprite(base_img, sprite, (x + ox, y + oy))
     
     return effect_settings
 
-def get_pet_position(img: Image.Image, pet_img: Image.Image, occupied_boxes: List[Tuple[int, int, int, int]], padding: int = 10) -> Tuple[int, int]:
+def get_pet_position(img: Image.Image, pet_img: Image.Image, occupied_boxes: List[Tuple[int, int, int, int]], padding: int = 10, 
+                     margin: int = 20) -> Tuple[int, int]:
     ew, eh = pet_img.size
     iw, ih = img.size
     possible_positions = [
-        (20, ih - eh - 20),
-        (iw - ew - 20, ih - eh - 20),
-        ((iw - ew) // 2, ih - eh - 20)
+        (margin, ih - eh - margin),
+        (iw - ew - margin, ih - eh - margin),
+        ((iw - ew) // 2, ih - eh - margin)
     ]
     for pos in possible_positions:
         new_box = (pos[0], pos[1], ew, eh)
         if not any_overlap(new_box, occupied_boxes, padding):
             return pos
     # Fallback
-    return find_non_overlapping_position((iw, ih), (ew, eh), occupied_boxes, None, 100, padding)
+    return find_non_overlapping_position((iw, ih), (ew, eh), occupied_boxes, None, 100, padding, allow_overlap=True, label="pet")
 
 def is_overlap(box1: Tuple[int, int, int, int], box2: Tuple[int, int, int, int]) -> bool:
     x1, y1, w1, h1 = box1
@@ -1599,8 +2801,48 @@ def any_overlap(new_box: Tuple[int, int, int, int], occupied: List[Tuple[int, in
             return True
     return False
 
+OCCUPANCY_GRID = 4
+
+def find_free_positions(img_size: Tuple[int, int], elem_size: Tuple[int, int], occupied: List[Tuple[int, int, int, int]], 
+                        padding: int = 10) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Every grid-aligned top-left where an elem_size box fits inside the image and keeps the same
+    clearance from the occupied boxes as any_overlap. Occupied boxes are rasterized (inflated by
+    2 * padding, rounded outwards) into a coarse bitmap; one prefix-sum window query then gives
+    the overlap count of every candidate at once.
+    Returns (counts, free): the overlap count of every candidate cell and the mask of cells with none.
+    Both are indexed [row, col] with a cell size of OCCUPANCY_GRID, and empty when the element does not fit.
+    """
+    iw, ih = img_size
+    ew, eh = elem_size
+    g = OCCUPANCY_GRID
+    cols, rows = -(-iw // g), -(-ih // g)
+    bitmap = np.zeros((rows, cols), dtype=np.int32)
+    for bx, by, bw, bh in occupied:
+        x0, y0 = max(0, (bx - 2 * padding) // g), max(0, (by - 2 * padding) // g)
+        x1, y1 = min(cols, -(-(bx + bw + 2 * padding) // g)), min(rows, -(-(by + bh + 2 * padding) // g))
+        if x1 > x0 and y1 > y0:
+            bitmap[y0:y1, x0:x1] = 1
+    
+    sat = np.zeros((rows + 1, cols + 1), dtype=np.int32)
+    sat[1:, 1:] = bitmap.cumsum(0).cumsum(1)
+    span_w, span_h = max(1, -(-ew // g)), max(1, -(-eh // g))
+    max_col, max_row = (iw - ew) // g, (ih - eh) // g
+    if ew > iw or eh > ih or span_w > cols or span_h > rows:
+        return np.zeros((0, 0), dtype=np.int32), np.zeros((0, 0), dtype=bool)
+    counts = _window_sums(sat, span_h, span_w)[:max_row + 1, :max_col + 1]
+    return counts, counts == 0
+
 def find_non_overlapping_position(img_size: Tuple[int, int], elem_size: Tuple[int, int], occupied: List[Tuple[int, int, int, int]], 
-                                  preferred_pos: Optional[Tuple[int, int]] = None, tries: int = 100, padding: int = 10) -> Tuple[int, int]:
+                                  preferred_pos: Optional[Tuple[int, int]] = None, tries: int = 100, padding: int = 10,
+                                  allow_overlap: bool = False, label: str = "element") -> Optional[Tuple[int, int]]:
+    """
+    Free position for an element: the preferred position if it is clear, otherwise the clear grid
+    position nearest to it (a random clear one when there is no preference).
+    When nothing is clear, returns None; callers that must place the element anyway pass allow_overlap
+    and get the position with the least overlap, with a warning naming the label.
+    tries is kept for existing callers; the grid query is exhaustive.
+    """
     iw, ih = img_size
     ew, eh = elem_size
     if preferred_pos:
@@ -1609,32 +2851,190 @@ def find_non_overlapping_position(img_size: Tuple[int, int], elem_size: Tuple[in
         y = max(0, min(y, ih - eh))
         if not any_overlap((x, y, ew, eh), occupied, padding):
             return x, y
-    for _ in range(tries):
-        x = random.randint(0, iw - ew)
-        y = random.randint(0, ih - eh)
-        if not any_overlap((x, y, ew, eh), occupied, padding):
-            return x, y
-    # Fallback to candidate positions
-    candidates = [
-        (0, 0),
-        (iw - ew, 0),
-        (0, ih - eh),
-        (iw - ew, ih - eh),
-        ((iw - ew) // 2, (ih - eh) // 2)
-    ]
-    for cx, cy in candidates:
-        if not any_overlap((cx, cy, ew, eh), occupied, padding):
-            return cx, cy
-    # Ultimate fallback
-    return (iw - ew, ih - eh)
+    
+    counts, free = find_free_positions(img_size, elem_size, occupied, padding)
+    if counts.size == 0:
+        if not allow_overlap:
+            return None
+        st.warning(f"The {label} is larger than the free image area and overlaps other elements.")
+        return max(0, iw - ew), max(0, ih - eh)
+    
+    g = OCCUPANCY_GRID
+    if free.any():
+        rows, cols = np.nonzero(free)
+        if preferred_pos:
+            dist = (cols * g - preferred_pos[0]) ** 2 + (rows * g - preferred_pos[1]) ** 2
+            pick = int(np.argmin(dist))
+        else:
+            pick = random.randrange(len(rows))
+        return int(cols[pick] * g), int(rows[pick] * g)
+    
+    if not allow_overlap:
+        return None
+    st.warning(f"No free space left for the {label}; it overlaps other elements.")
+    row, col = np.unravel_index(int(np.argmin(counts)), counts.shape)
+    return int(col * g), int(row * g)
+
+FACE_CASCADE_FILE = os.path.join(BUNDLED_FONT_DIR, "haarcascade_frontalface_default.xml")
+FACE_CACHE_ENTRIES = 256
+FACE_BOX_MARGIN = 0.3
+
+@st.cache_resource
+def get_face_cascade() -> Optional[dict]:
+    try:
+        return load_haar_cascade(FACE_CASCADE_FILE)
+    except Exception:
+        return None
+
+@st.cache_resource
+def get_face_cache() -> dict:
+    # Boxes are tiny, so the budget counts uploads (each is put with size 1)
+    return new_lru_cache(FACE_CACHE_ENTRIES)
+
+def find_faces(img: Image.Image, key: Optional[str] = None) -> List[Tuple[int, int, int, int]]:
+    """Face boxes (x, y, w, h) of an uploaded image, detected once per upload content key."""
+    cache = get_face_cache()
+    if key is not None:
+        cached = lru_get(cache, key)
+        if cached is not None:
+            return cached
+    
+    cascade = get_face_cascade()
+    boxes = detect_faces(img, cascade) if cascade is not None else []
+    if key is not None:
+        lru_put(cache, key, boxes, 1)
+    return boxes
+
+def crop_face_boxes(boxes: List[Tuple[int, int, int, int]], crop_box: Tuple[int, int, int, int]) -> List[Tuple[int, int, int, int]]:
+    """Move face boxes into the coordinates of a crop, dropping the ones that fall outside it."""
+    left, top, right, bottom = crop_box
+    moved = []
+    for x, y, w, h in boxes:
+        x0, y0 = max(x, left), max(y, top)
+        x1, y1 = min(x + w, right), min(y + h, bottom)
+        if x1 > x0 and y1 > y0:
+            moved.append((x0 - left, y0 - top, x1 - x0, y1 - y0))
+    return moved
+
+def face_keepout_boxes(img_size: Tuple[int, int], faces: List[Tuple[int, int, int, int]]) -> List[Tuple[int, int, int, int]]:
+    """Face boxes grown to cover hair and chin, for seeding occupied_boxes."""
+    iw, ih = img_size
+    boxes = []
+    for x, y, w, h in faces:
+        mx, my = int(w * FACE_BOX_MARGIN), int(h * FACE_BOX_MARGIN)
+        x0, y0 = max(0, x - mx), max(0, y - my)
+        x1, y1 = min(iw, x + w + mx), min(ih, y + h + my)
+        boxes.append((x0, y0, x1 - x0, y1 - y0))
+    return boxes
 
 def get_overlap_percentage(year, theme):
-    overlap_settings = _load_overlap_settings()
-    key = f"{year}_{theme}"
-    return overlap_settings.get(key, 14)
+    return theme_overlap_percentage(find_theme(year, theme))
+
+def theme_overlap_percentage(entry: Optional[dict]) -> int:
+    """Overlap of a catalog entry: the admin's setting, else the compiled suggestion, else 14."""
+    if entry is None:
+        return 14
+    if entry["overlap"] is not None:
+        return entry["overlap"]
+    if entry["suggested_overlap"] is not None:
+        return entry["suggested_overlap"]
+    return 14
+
+BACKGROUND_SIZE = (750, 1000)
+BACKGROUND_DIR = "backgrounds"
+# Text sizes, offsets and overlay scales in the settings are in pixels of a BACKGROUND_SIZE canvas
+OUTPUT_PRESETS = {
+    "750×1000 (Standard)": (750, 1000),
+    "1080×1440 (HD)": (1080, 1440),
+    "1500×2000 (Full HD)": (1500, 2000),
+    "3000×4000 (Print)": (3000, 4000)
+}
+DEFAULT_OUTPUT_PRESET = "1080×1440 (HD)"
+BACKGROUND_LIBRARY_DIR = os.path.join("compiled", "backgrounds")
+
+def background_library_dir() -> str:
+    # A mounted archive is read-only, so its library lives in the asset cache instead
+    if is_archive_path(ASSETS_DIR):
+        return os.path.join(ASSET_CACHE_DIR, "backgrounds")
+    return os.path.join(ASSETS_DIR, BACKGROUND_LIBRARY_DIR)
+
+def list_backgrounds() -> List[str]:
+    """Pre-made background file names, re-listed only when the folder changes."""
+    index = get_background_index()
+    bg_folder = os.path.join(ASSETS_DIR, BACKGROUND_DIR)
+    try:
+        signature = asset_version(bg_folder)
+    except OSError:
+        return list_files(bg_folder, [".jpg", ".png", ".jpeg"])
+    with index["lock"]:
+        if index["signature"] != signature:
+            index["files"] = sorted(list_files(bg_folder, [".jpg", ".png", ".jpeg"]))
+            index["signature"] = signature
+        return index["files"]
+
+def background_library_path(name: str, size: Tuple[int, int] = BACKGROUND_SIZE) -> str:
+    """Where the prepared copy of a background lives; the name changes when the source does."""
+    version = asset_version(os.path.join(ASSETS_DIR, BACKGROUND_DIR, name))
+    source_key = f"{name}:{version[0]}:{version[1]}"
+    if tuple(size) != BACKGROUND_SIZE:
+        source_key += f":{size[0]}x{size[1]}"
+    digest = hashlib.sha1(source_key.encode()).hexdigest()[:12]
+    return os.path.join(background_library_dir(), f"{_background_library_prefix(name, size)}_{digest}.jpg")
+
+def _background_library_prefix(name: str, size: Tuple[int, int]) -> str:
+    prefix = os.path.splitext(name)[0]
+    if tuple(size) != BACKGROUND_SIZE:
+        prefix += f"_{size[0]}x{size[1]}"
+    return prefix
+
+def _prune_background_library(name: str, size: Tuple[int, int], keep: str):
+    """Delete prepared copies of a background at this size that an older source version left behind."""
+    folder, keep_name = os.path.split(keep)
+    prefix = _background_library_prefix(name, size) + "_"
+    for entry in os.listdir(folder):
+        digest = entry[len(prefix):-len(".jpg")]
+        if (entry != keep_name and entry.startswith(prefix) and entry.endswith(".jpg")
+                and len(digest) == 12 and all(c in "0123456789abcdef" for c in digest)):
+            try:
+                os.remove(os.path.join(folder, entry))
+            except OSError:
+                pass
 
-def generate_background(background_type: str) -> Image.Image:
-    width, height = 750, 1000  # 3:4 ratio
+def prepare_background(name: str, size: Tuple[int, int] = BACKGROUND_SIZE) -> Image.Image:
+    bg = Image.open(open_asset(os.path.join(ASSETS_DIR, BACKGROUND_DIR, name)))
+    # Let JPEG decode at the smallest scale that still covers the final crop
+    bg.draft("RGB", tuple(size))
+    bg = smart_crop(bg.convert("RGB"), 3/4)
+    return bg.resize(tuple(size), Image.LANCZOS, reducing_gap=3.0)
+
+def load_background(name: str, size: Tuple[int, int] = BACKGROUND_SIZE) -> Image.Image:
+    """
+    A pre-made background cropped to 3:4 at the given size. Served from memory, then from the
+    prepared library on disk, and only prepared from the source photo once. Shared, so do not modify it.
+    """
+    lib_path = background_library_path(name, size)
+    cache = get_background_cache()
+    bg = lru_get(cache, lib_path)
+    if bg is not None:
+        return bg
+    
+    try:
+        bg = Image.open(lib_path)
+        bg.load()
+    except OSError:
+        bg = prepare_background(name, size)
+        try:
+            os.makedirs(os.path.dirname(lib_path), exist_ok=True)
+            bg.save(lib_path, quality=95, subsampling=0)
+            _prune_background_library(name, size, lib_path)
+        except OSError:
+            pass
+
+    lru_put(cache, lib_path, bg, bg.width * bg.height * 3)
+    return bg
+
+def generate_background(background_type: str, size: Tuple[int, int] = BACKGROUND_SIZE) -> Image.Image:
+    width, height = size  # 3:4 ratio
     if background_type == "Random Color":
         if random.random() < 0.4:
             color = (255, 255, 255)
@@ -1658,22 +3058,33 @@ def generate_background(background_type: str) -> Image.Image:
                 colors = random.choice(gradient_options)
                 return create_gradient_mask(width, height, colors, random.choice(['horizontal', 'vertical']))
     elif background_type == "Pre-made Image":
-        bg_folder = os.path.join(ASSETS_DIR, "backgrounds")
-        bg_files = list_files(bg_folder, [".jpg", ".png", ".jpeg", ".JPG", ".PNG", ".JPEG"])
+        bg_files = list_backgrounds()
         if bg_files:
-            path = random.choice(bg_files)
-            full_path = os.path.join(bg_folder, path)
-            bg = Image.open(full_path).convert("RGB")
-            return smart_crop(bg, 3/4).resize((width, height), Image.LANCZOS)
+            name = random.choice(bg_files)
+            record_asset_use("background", name, {"size": [width, height]})
+            return load_background(name, (width, height))
         else:
             return Image.new("RGB", (width, height), (255, 255, 255))
     return Image.new("RGB", (width, height), (255, 255, 255))
 
-def create_variant(original_img: Optional[Image.Image], settings: dict) -> Optional[Image.Image]:
+def create_variant(original_img: Optional[Image.Image], settings: dict, 
+                   face_boxes: Optional[List[Tuple[int, int, int, int]]] = None) -> Optional[Image.Image]:
     try:
+        output_size = tuple(settings.get('output_size', BACKGROUND_SIZE))
         img = original_img
         if img is None:
-            img = generate_background(settings['background_type'])
+            img = generate_background(settings['background_type'], output_size)
+        
+        # Everything is composed at the output size, so nothing is resampled after the text is drawn
+        face_boxes = list(face_boxes or [])
+        if img.size != output_size:
+            face_boxes = scale_boxes(face_boxes, output_size[0] / img.width, output_size[1] / img.height)
+            img = fit_output_size(img, output_size)
+        layout_scale = img.width / BACKGROUND_SIZE[0]
+        
+        def px(value):
+            return int(round(value * layout_scale))
+        
         img = img.convert("RGBA")
         draw = ImageDraw.Draw(img)
         
@@ -1682,147 +3093,101 @@ def create_variant(original_img: Optional[Image.Image], settings: dict) -> Optio
             return None
         
         dominant_color = get_dominant_color(img)
+        placement = build_placement_tables(img)
         
         effect_settings = {
             'type': settings.get('text_effect', 'gradient'),
             'outline_size': 2,
-            'colors': get_gradient_colors(dominant_color) if settings.get('text_effect', 'gradient') == 'gradient' else get_multi_gradient_colors()
+            'colors': get_gradient_colors(dominant_color) if settings.get('text_effect', 'gradient') == 'gradient' else get_multi_gradient_colors(),
+            'scale': layout_scale
         }
         
         style_mode = settings.get('style_mode', 'Text')
         
         overlap_percent = settings.get('overlap_percent', 14)
         
-        occupied_boxes = []
+        # Faces found at upload time are kept clear of text and overlays
+        occupied_boxes = face_keepout_boxes(img.size, face_boxes)
         
-        min_distance = 20
+        min_distance = px(20)
         padding = min_distance // 2
+        edge_margin = px(20)  # gap kept between corner-placed elements and the image edge
         
         if style_mode == 'PNG Overlay' and settings['greeting_type'] in ["Good Morning", "Good Night"]:
-            years = list_subfolders(os.path.join(ASSETS_DIR, "overlays"))
-            if not years:
+            theme_catalog = get_theme_catalog()
+            if not theme_catalog:
                 st.warning("No overlay years found.")
                 return img.convert("RGB")
             
             overlay_year = settings.get('overlay_year', "2025")
             if overlay_year == "ALL":
-                selected_years = years
+                selected_years = list(theme_catalog)
             else:
                 selected_years = [overlay_year]
-                if overlay_year not in years:
+                if overlay_year not in theme_catalog:
                     st.warning("Selected year not found.")
                     return img.convert("RGB")
             
-            theme_paths = []
-            for y in selected_years:
-                year_path = os.path.join(ASSETS_DIR, "overlays", y)
-                sub_themes = list_subfolders(year_path)
-                if not sub_themes:
-                    if list_files(year_path, [".png"]):
-                        theme_paths.append((y, year_path))
-                else:
-                    for t in sub_themes:
-                        theme_paths.append((t, os.path.join(year_path, t)))
+            themes = [e for y in selected_years for e in theme_catalog[y] if e["members"]]
             
-            if not theme_paths:
+            if not themes:
                 st.warning("No overlay themes found.")
                 return img.convert("RGB")
             
-            theme_name, base_path = random.choice(theme_paths)
-            
-            overlap_percent = get_overlap_percentage(overlay_year, theme_name)
+            theme = random.choice(themes)
             
-            png_files = []
-            if settings['greeting_type'] == "Good Morning":
-                png_files = ["1.png", "2.png"]
-                if settings['show_wish']:
-                    png_files.append("4.png")
-            elif settings['greeting_type'] == "Good Night":
-                png_files = ["1.png", "3.png"]
-                if settings['show_wish']:
-                    png_files.append("5.png")
+            overlap_percent = theme_overlap_percentage(theme)
+            record_asset_use("overlay", f"{theme['year']}/{theme['theme']}", {
+                "greeting_type": settings['greeting_type'],
+                "show_wish": settings['show_wish'],
+                "png_size": settings.get('png_size', 0.5) * layout_scale,
+                "img_size": list(img.size),
+                "layout_scale": layout_scale
+            })
             
-            pngs = []
-            for f in png_files:
-                path = os.path.join(base_path, f)
-                if os.path.exists(path):
-                    png_img = Image.open(path).convert("RGBA")
-                    png_img._filename = os.path.basename(path)
-                    pngs.append(png_img)
+            stack = get_overlay_stack(theme, settings['greeting_type'], settings['show_wish'], overlap_percent, 
+                                      settings.get('png_size', 0.5) * layout_scale, img.size, random.randrange(OVERLAY_STACK_VARIANTS),
+                                      layout_scale)
             
-            if pngs:
-                main_pngs = [p for p in pngs if p._filename in ["1.png", "2.png", "3.png"]]
-                wish_pngs = [p for p in pngs if p._filename in ["4.png", "5.png"]]
-                
-                main_pngs.sort(key=lambda x: 0 if x._filename == "1.png" else 1)
-                
-                pngs = main_pngs + wish_pngs
-                
-                main_gap = -int(min([p.height for p in main_pngs]) * overlap_percent / 100) if len(main_pngs) >= 2 else 0
-                wish_gap = min_distance
-                
-                gaps = [main_gap] * (len(pngs) - 1)
-                if settings['show_wish'] and len(wish_pngs) > 0:
-                    gaps[-1] = wish_gap
-                
-                total_h = sum(p.height for p in pngs) + sum(gaps)
-                max_w = max(p.width for p in pngs)
-                
-                png_size = settings.get('png_size', 0.5)
-                scale = min(png_size, min((img.width * 0.9) / max_w, (img.height * 0.9) / total_h))
-                pngs = [p.resize((int(p.width * scale), int(p.height * scale)), Image.LANCZOS) for p in pngs]
-                
-                total_h = sum(p.height for p in pngs) + sum(gaps)
-                max_w = max(p.width for p in pngs)
+            if stack is not None:
+                sprite, last_y = stack
+                total_h = sprite.height
+                max_w = sprite.width
                 
                 main_position = random.choice(["top", "bottom"])
                 if main_position == "top":
-                    start_y = random.randint(20, img.height // 4)
+                    start_y = random.randint(px(20), img.height // 4)
                 else:
-                    start_y = img.height - total_h - random.randint(20, img.height // 4)
+                    start_y = img.height - total_h - random.randint(px(20), img.height // 4)
                 
                 if settings.get('custom_position', False):
-                    start_x = settings.get('text_x', 100)
-                    start_y = settings.get('text_y', 100)
+                    start_x = px(settings.get('text_x', 100))
+                    start_y = px(settings.get('text_y', 100))
                 else:
-                    start_x = get_random_horizontal_position(img.width, max_w)
+                    start_x = get_random_horizontal_position(img.width, max_w, margin=edge_margin)
                 
                 start_x = max(0, min(start_x, img.width - max_w))
                 start_y = max(0, min(start_y, img.height - total_h))
                 
                 # Find non-overlapping position for the group
-                start_x, start_y = find_non_overlapping_position(img.size, (max_w, total_h), occupied_boxes, (start_x, start_y), 100, padding)
-                
-                current_y = start_y
-                group_boxes = []
-                for i, p in enumerate(pngs):
-                    offset = random.randint(-20, 20)
-                    x = start_x + (max_w - p.width) // 2 + offset
-                    x = max(0, min(x, img.width - p.width))
-                    y = max(0, min(current_y, img.height - p.height))
-                    img.paste(p, (x, y), p)
-                    group_boxes.append((x, y, p.width, p.height))
-                    if i < len(pngs) - 1:
-                        current_y += p.height + gaps[i]
+                start_x, start_y = find_non_overlapping_position(img.size, (max_w, total_h), occupied_boxes, (start_x, start_y), 100, padding,
+                                                                 allow_overlap=True, label="greeting overlay")
                 
-                # Add group bounding box
-                gx = min(b[0] for b in group_boxes)
-                gy = min(b[1] for b in group_boxes)
-                gw = max(b[0] + b[2] for b in group_boxes) - gx
-                gh = max(b[1] + b[3] for b in group_boxes) - gy
-                occupied_boxes.append((gx, gy, gw, gh))
+                img.paste(sprite, (start_x, start_y), sprite)
+                occupied_boxes.append((start_x, start_y, max_w, total_h))
                 
-                main_end_y = current_y
+                main_end_y = start_y + last_y
             else:
                 st.warning("Missing PNG files for selected theme.")
         else:
             if settings['show_text']:
-                font_size = settings['main_size']
-                font_main = font.font_variant(size=font_size)
                 main_texts = settings['greeting_type'].split()
                 if not main_texts:
                     main_texts = ["ULTRA", "PRO"]
                 
+                font_size = fit_text_size(font, main_texts, img.width * 0.8, px(settings['main_size']))
+                font_main = get_sized_font(font, font_size)
+                
                 line_heights = []
                 line_widths = []
                 for t in main_texts:
@@ -1834,40 +3199,35 @@ def create_variant(original_img: Optional[Image.Image], settings: dict) -> Optio
                 total_h = sum(line_heights) + (len(main_texts) - 1) * main_gap
                 max_w = max(line_widths)
                 
-                while max(line_widths) > img.width * 0.8 and font_size > 10:
-                    font_size -= 5
-                    font_main = font.font_variant(size=font_size)
-                    line_widths = []
-                    line_heights = []
-                    for t in main_texts:
-                        w, h = get_text_size(draw, t, font_main)
-                        line_widths.append(w)
-                        line_heights.append(h)
-                    total_h = sum(line_heights) + (len(main_texts) - 1) * main_gap
-                    max_w = max(line_widths)
-                
                 main_position = random.choice(["top", "bottom"])
                 if main_position == "top":
-                    text_y = random.randint(20, img.height // 4)
+                    text_y = random.randint(px(20), img.height // 4)
+                    y_range = (px(20), img.height // 4)
                 else:
-                    text_y = img.height - total_h - random.randint(20, img.height // 4)
+                    text_y = img.height - total_h - random.randint(px(20), img.height // 4)
+                    y_range = (img.height - total_h - img.height // 4, img.height - total_h - px(20))
                 
                 if settings.get('custom_position', False):
-                    text_x = settings.get('text_x', 100)
-                    text_y = settings.get('text_y', 100)
+                    text_x = px(settings.get('text_x', 100))
+                    text_y = px(settings.get('text_y', 100))
                 else:
-                    text_x = get_random_horizontal_position(img.width, max_w)
+                    text_x = get_random_horizontal_position(img.width, max_w, margin=edge_margin)
+                    calm = find_calm_position(placement, (max_w, total_h), y_range, occupied_boxes, padding)
+                    if calm:
+                        text_x, text_y = calm
                 
                 text_x = max(0, min(text_x, img.width - max_w))
                 text_y = max(0, min(text_y, img.height - total_h))
                 
                 # Find non-overlapping position for the group
-                text_x, text_y = find_non_overlapping_position(img.size, (max_w, total_h), occupied_boxes, (text_x, text_y), 100, padding)
+                text_x, text_y = find_non_overlapping_position(img.size, (max_w, total_h), occupied_boxes, (text_x, text_y), 100, padding,
+                                                               allow_overlap=True, label="greeting")
+                effect_settings['backdrop_luma'] = region_luminance(placement, (text_x, text_y, max_w, total_h))
                 
                 current_y = text_y
                 group_boxes = []
                 for i, t in enumerate(main_texts):
-                    offset = random.randint(-30, 50)
+                    offset = random.randint(px(-30), px(50))
                     line_x = text_x + (max_w - line_widths[i]) // 2 + offset
                     line_x = max(0, min(line_x, img.width - line_widths[i]))
                     y_pos = max(0, min(current_y, img.height - line_heights[i]))
@@ -1885,29 +3245,16 @@ def create_variant(original_img: Optional[Image.Image], settings: dict) -> Optio
                 main_end_y = gy + gh
             
             if settings['show_wish']:
-                font_size = settings['wish_size']
-                font_wish = font.font_variant(size=font_size)
                 wish_text = settings.get('custom_wish', None)
                 if wish_text is None or wish_text.strip() == "":
                     wish_text = get_random_wish(settings['greeting_type'])
                 
-                avg_char_width = get_text_size(draw, "A", font_wish)[0]
-                wrap_width = int((img.width * 0.8) / avg_char_width)
-                lines = textwrap.wrap(wish_text, width=wrap_width)
-                
-                while len(lines) > 3 and font_size > 10:
-                    font_size -= 5
-                    font_wish = font.font_variant(size=font_size)
-                    avg_char_width = get_text_size(draw, "A", font_wish)[0]
-                    wrap_width = int((img.width * 0.8) / avg_char_width)
-                    lines = textwrap.wrap(wish_text, width=wrap_width)
-                
-                line_heights = []
-                line_widths = []
-                for line in lines:
-                    w, h = get_text_size(draw, line, font_wish)
-                    line_widths.append(w)
-                    line_heights.append(h)
+                font_size = fit_wrapped_size(font, wish_text, img.width * 0.8, px(settings['wish_size']))
+                font_wish = get_sized_font(font, font_size)
+                wrapped = wrap_text(font_wish, wish_text, img.width * 0.8)
+                lines = [line for line, _, _ in wrapped]
+                line_widths = [w for _, w, _ in wrapped]
+                line_heights = [h for _, _, h in wrapped]
                 
                 wish_gap = min_distance
                 total_h = sum(line_heights) + (len(lines) - 1) * wish_gap
@@ -1915,28 +3262,36 @@ def create_variant(original_img: Optional[Image.Image], settings: dict) -> Optio
                 
                 wish_position = random.choice(["mid", "bottom"])
                 if wish_position == "mid":
-                    wish_y = img.height // 2 - total_h // 2 + random.randint(-50, 50)
-                else:
-                    wish_y = img.height - total_h - random.randint(20, 100)
-                
-                if settings.get('custom_position', False):
-                    wish_x = settings.get('text_x', 100)
+                    wish_y = img.height // 2 - total_h // 2 + random.randint(px(-50), px(50))
+                    y_range = (img.height // 2 - total_h // 2 - px(50), img.height // 2 - total_h // 2 + px(50))
                 else:
-                    wish_x = get_random_horizontal_position(img.width, max_w)
+                    wish_y = img.height - total_h - random.randint(px(20), px(100))
+                    y_range = (img.height - total_h - px(100), img.height - total_h - px(20))
                 
                 if settings['show_text']:
                     wish_y = max(wish_y, main_end_y + min_distance)
+                    y_range = (max(y_range[0], main_end_y + min_distance), y_range[1])
+                
+                if settings.get('custom_position', False):
+                    wish_x = px(settings.get('text_x', 100))
+                else:
+                    wish_x = get_random_horizontal_position(img.width, max_w, margin=edge_margin)
+                    calm = find_calm_position(placement, (max_w, total_h), y_range, occupied_boxes, padding)
+                    if calm:
+                        wish_x, wish_y = calm
                 
                 wish_x = max(0, min(wish_x, img.width - max_w))
                 wish_y = max(0, min(wish_y, img.height - total_h))
                 
                 # Find non-overlapping position
-                wish_x, wish_y = find_non_overlapping_position(img.size, (max_w, total_h), occupied_boxes, (wish_x, wish_y), 100, padding)
+                wish_x, wish_y = find_non_overlapping_position(img.size, (max_w, total_h), occupied_boxes, (wish_x, wish_y), 100, padding,
+                                                               allow_overlap=True, label="wish")
+                effect_settings['backdrop_luma'] = region_luminance(placement, (wish_x, wish_y, max_w, total_h))
                 
                 current_y = wish_y
                 group_boxes = []
                 for i, line in enumerate(lines):
-                    offset = random.randint(-20, 20)
+                    offset = random.randint(px(-20), px(20))
                     line_x = wish_x + (max_w - line_widths[i]) // 2 + offset
                     line_x = max(0, min(line_x, img.width - line_widths[i]))
                     y_pos = max(0, min(current_y, img.height - line_heights[i]))
@@ -1952,7 +3307,7 @@ def create_variant(original_img: Optional[Image.Image], settings: dict) -> Optio
                 occupied_boxes.append((gx, gy, gw, gh))
         
         if settings['show_date']:
-            font_date = font.font_variant(size=settings['date_size'])
+            font_date = get_sized_font(font, px(settings['date_size']))
             
             if settings['date_format'] == "8 July 2025":
                 date_text = format_date("%d %B %Y", settings['show_day'])
@@ -1965,27 +3320,31 @@ def create_variant(original_img: Optional[Image.Image], settings: dict) -> Optio
                 
             date_width, date_height = get_text_size(draw, date_text, font_date)
             
-            date_x = get_random_horizontal_position(img.width, date_width)
-            date_y = img.height - date_height - 20
+            date_x = get_random_horizontal_position(img.width, date_width, margin=edge_margin)
+            date_y = img.height - date_height - px(20)
+            calm = find_calm_position(placement, (date_width, date_height), (date_y - px(40), date_y), occupied_boxes, padding)
+            if calm:
+                date_x, date_y = calm
             
             preferred = (date_x, date_y)
-            date_x, date_y = find_non_overlapping_position(img.size, (date_width, date_height), occupied_boxes, preferred, 100, padding)
+            date_x, date_y = find_non_overlapping_position(img.size, (date_width, date_height), occupied_boxes, preferred, 100, padding,
+                                                           allow_overlap=True, label="date")
+            effect_settings['backdrop_luma'] = region_luminance(placement, (date_x, date_y, date_width, date_height))
             
             apply_text_effect(draw, (date_x, date_y), date_text, font_date, effect_settings, img)
             occupied_boxes.append((date_x, date_y, date_width, date_height))
         
         if settings['show_quote']:
-            font_quote = font.font_variant(size=settings['quote_size'])
+            font_quote = get_sized_font(font, px(settings['quote_size']))
             quote_text = settings['quote_text']
             
-            lines = [line.strip() for line in quote_text.split('\n') if line.strip()]
-            
-            line_heights = []
-            line_widths = []
-            for line in lines:
-                w, h = get_text_size(draw, line, font_quote)
-                line_widths.append(w)
-                line_heights.append(h)
+            wrapped = []
+            for paragraph in quote_text.split('\n'):
+                if paragraph.strip():
+                    wrapped.extend(wrap_text(font_quote, paragraph.strip(), img.width * 0.8))
+            lines = [line for line, _, _ in wrapped]
+            line_widths = [w for _, w, _ in wrapped]
+            line_heights = [h for _, _, h in wrapped]
             
             quote_gap = min_distance
             total_h = sum(line_heights) + (len(lines) - 1) * quote_gap
@@ -1993,8 +3352,13 @@ def create_variant(original_img: Optional[Image.Image], settings: dict) -> Optio
             
             quote_x = (img.width - max_w) // 2
             quote_y = (img.height - total_h) // 2
+            calm = find_calm_position(placement, (max_w, total_h), (quote_y - px(100), quote_y + px(100)), occupied_boxes, padding)
+            if calm:
+                quote_x, quote_y = calm
             
-            quote_x, quote_y = find_non_overlapping_position(img.size, (max_w, total_h), occupied_boxes, (quote_x, quote_y), 100, padding)
+            quote_x, quote_y = find_non_overlapping_position(img.size, (max_w, total_h), occupied_boxes, (quote_x, quote_y), 100, padding,
+                                                             allow_overlap=True, label="quote")
+            effect_settings['backdrop_luma'] = region_luminance(placement, (quote_x, quote_y, max_w, total_h))
             
             current_y = quote_y
             group_boxes = []
@@ -2022,7 +3386,7 @@ def create_variant(original_img: Optional[Image.Image], settings: dict) -> Optio
                 watermark.putalpha(alpha)
             
             watermark.thumbnail((img.width//4, img.height//4))
-            pos = get_watermark_position(img, watermark, occupied_boxes, padding)
+            pos = get_watermark_position(img, watermark, occupied_boxes, padding, margin=edge_margin)
             pos = (max(0, min(pos[0], img.width - watermark.width)), 
                    max(0, min(pos[1], img.height - watermark.height)))
             
@@ -2038,14 +3402,14 @@ def create_variant(original_img: Optional[Image.Image], settings: dict) -> Optio
                 selected_pet = settings['pet_choice']
             if selected_pet:
                 pet_path = os.path.join(ASSETS_DIR, "pets", selected_pet)
-                if os.path.exists(pet_path):
-                    pet_img = Image.open(pet_path).convert("RGBA")
+                if asset_exists(pet_path):
+                    pet_img = decode_asset_image(pet_path)
                     pet_img = pet_img.resize(
                         (int(img.width * settings['pet_size']), 
                          int((img.width * settings['pet_size']) * (pet_img.height / pet_img.width))),
                         Image.LANCZOS
                     )
-                    pet_pos = get_pet_position(img, pet_img, occupied_boxes, padding)
+                    pet_pos = get_pet_position(img, pet_img, occupied_boxes, padding, margin=edge_margin)
                     pet_pos = (max(0, min(pet_pos[0], img.width - pet_img.width)), 
                                max(0, min(pet_pos[1], img.height - pet_img.height)))
                     
@@ -2053,21 +3417,22 @@ def create_variant(original_img: Optional[Image.Image], settings: dict) -> Optio
                     occupied_boxes.append((pet_pos[0], pet_pos[1], pet_img.width, pet_img.height))
         
         if settings.get('apply_emoji', False) and settings.get('emojis'):
-            img = apply_emoji_stickers(img, settings['emojis'], occupied_boxes, settings.get('num_emojis', 5), padding)
+            img = apply_emoji_stickers(img, settings['emojis'], occupied_boxes, settings.get('num_emojis', 5), padding, px(40))
         
         img = enhance_image_quality(
             img,
             settings.get('brightness', 1.0),
             settings.get('contrast', 1.0),
             settings.get('sharpness', 1.2),
-            settings.get('saturation', 1.1)
+            settings.get('saturation', 1.1),
+            sepia=settings.get('apply_sepia', False),
+            black_white=settings.get('apply_bw', False)
         )
         
-        if settings.get('apply_sepia', False):
-            img = apply_sepia(img)
-        
-        if settings.get('apply_bw', False):
-            img = apply_black_white(img)
+        if settings.get('lut_preset'):
+            lut = get_color_lut(settings['lut_preset'])
+            if lut is not None:
+                img = img.filter(lut)
         
         if settings.get('apply_vintage', False):
             img = apply_vintage(img)
@@ -2075,16 +3440,12 @@ def create_variant(original_img: Optional[Image.Image], settings: dict) -> Optio
         if settings.get('apply_vignette', False):
             img = apply_vignette(img, settings.get('vignette_intensity', 0.8))
         
-        if settings.get('apply_sketch', False):
-            img = apply_sketch_effect(img)
-        
-        if settings.get('apply_cartoon', False):
-            img = apply_cartoon_effect(img)
-        
-        if settings.get('apply_anime', False):
-            img = apply_anime_effect(img)
-        
-        img = upscale_text_elements(img, scale_factor=settings.get('upscale_factor', 4))
+        img = apply_stylize_filters(
+            img,
+            sketch=settings.get('apply_sketch', False),
+            cartoon=settings.get('apply_cartoon', False),
+            anime=settings.get('apply_anime', False)
+        )
         
         return img.convert("RGB")
     
@@ -2093,6 +3454,70 @@ def create_variant(original_img: Optional[Image.Image], settings: dict) -> Optio
         st.error(traceback.format_exc())
         return None
 
+# =================== ASSET WARM-UP ===================
+def warm_fonts():
+    faces = register_font_folder(os.path.join(ASSETS_DIR, "fonts")) or register_font_folder(BUNDLED_FONT_DIR)
+    for face_key in faces:
+        get_font(face_key, 80)
+
+def warm_overlay_theme(name: str, detail: Optional[dict]):
+    """Decode a theme's PNGs and, when its usual settings are known, build all its stack variants."""
+    year, _, theme_name = name.partition("/")
+    theme = find_theme(year, theme_name)
+    if theme is None:
+        return
+    for member in theme["members"]:
+        _decode_overlay(os.path.join(theme["path"], member))
+    if detail:
+        overlap_percent = theme_overlap_percentage(theme)
+        for variant in range(OVERLAY_STACK_VARIANTS):
+
+            get_overlay_stack(theme, detail["greeting_type"], detail["show_wish"], overlap_percent, 
+                              detail["png_size"], tuple(detail["img_size"]), variant, detail.get("layout_scale", 1.0))
+
+
+def warmup_steps() -> List[Tuple[str, object]]:
+    """Warm-up work as (label, callable), cheapest and most widely needed first."""
+    steps = [
+        ("Fonts", warm_fonts),
+        ("Theme catalog", get_theme_catalog),
+        ("Asset manifest", get_asset_manifest),
+        ("Asset bundle", get_asset_bundle),
+        ("Face detector", get_face_cascade),
+        ("Background list", list_backgrounds),
+        ("Color LUTs", lambda: [get_color_lut(name) for name in list_lut_presets()
+                                if _load_tool_settings().get("lut", {}).get(name, True)])
+    ]
+    
+    overlays = get_popular_assets("overlay", WARMUP_TOP_OVERLAYS)
+    if not overlays:
+        # No usage yet: the newest year's themes are the likeliest picks
+        catalog = get_theme_catalog()
+        newest = max(catalog) if catalog else None
+        overlays = [(f"{e['year']}/{e['theme']}", None) for e in catalog.get(newest, [])[:WARMUP_TOP_OVERLAYS]]
+    for name, detail in overlays:
+        steps.append((f"Overlay theme {name}", lambda name=name, detail=detail: warm_overlay_theme(name, detail)))
+    
+    backgrounds = get_popular_assets("background", WARMUP_TOP_BACKGROUNDS)
+    available = set(list_backgrounds())
+    for name, detail in backgrounds:
+        if name in available:
+            size = tuple(detail["size"]) if detail else BACKGROUND_SIZE
+            steps.append((f"Background {name}", lambda name=name, size=size: load_background(name, size)))
+    return steps
+
+def publish_warmup_plan():
+    """Hand warmup_steps to the warm-up thread, which waits for it; later runs leave the first plan in place."""
+    state = get_warmup_state()
+    with state["lock"]:
+        if state["plan"] is None:
+            state["plan"] = warmup_steps
+    state["ready"].set()
+
+# Everything the warm-up calls is defined by now; the admin panel stops the script before this point
+publish_warmup_plan()
+
+
 # =================== MAIN APP ===================
 if 'generated_images' not in st.session_state:
     st.session_state.generated_images = []
@@ -2135,8 +3560,10 @@ if background_type == "Uploaded Image":
         for uploaded_file in uploaded_images:
             try:
                 img = Image.open(uploaded_file)
-                cropped_img = smart_crop(img, 3/4)
-                st.session_state.cropped_images.append((uploaded_file.name, cropped_img))
+                faces = find_faces(img, hashlib.sha1(uploaded_file.getvalue()).hexdigest())
+                crop_box = smart_crop_box(img.size, 3/4, faces)
+                cropped_img = img.crop(crop_box)
+                st.session_state.cropped_images.append((uploaded_file.name, cropped_img, crop_face_boxes(faces, crop_box)))
             except Exception as e:
                 st.error(f"Error processing {uploaded_file.name}: {str(e)}")
     
@@ -2144,7 +3571,7 @@ if background_type == "Uploaded Image":
         st.info(f"✅ {len(st.session_state.cropped_images)} images cropped to 3:4 ratio")
         with st.expander("Preview Cropped Images"):
             cols = st.columns(3)
-            for i, (name, img) in enumerate(st.session_state.cropped_images):
+            for i, (name, img, _) in enumerate(st.session_state.cropped_images):
                 with cols[i % 3]:
                     st.image(img, caption=name, use_container_width=True)
 else:
@@ -2165,7 +3592,7 @@ with st.sidebar:
     
     style_mode = st.selectbox("Style Mode", ["PNG Overlay", "Text"], index=0)
     
-    overlay_years = list_subfolders(os.path.join(ASSETS_DIR, "overlays"))
+    overlay_years = list(get_theme_catalog())
     if not overlay_years:
         overlay_years = ["2024", "2025"]
     
@@ -2258,8 +3685,8 @@ with st.sidebar:
                 selected_watermarks = st.multiselect("Select Watermark(s)", watermark_files, default=default)
                 for watermark_file in selected_watermarks:
                     watermark_path = os.path.join(ASSETS_DIR, "logos", watermark_file)
-                    if os.path.exists(watermark_path):
-                        watermark_images.append(Image.open(watermark_path).convert("RGBA"))
+                    if asset_exists(watermark_path):
+                        watermark_images.append(decode_asset_image(watermark_path))
         else:
             uploaded_watermark = st.file_uploader("Upload Watermark", type=["png"], accept_multiple_files=True)
             if uploaded_watermark:
@@ -2314,10 +3741,17 @@ with st.sidebar:
         apply_sketch = st.checkbox("Apply Sketch Effect", value=False) if tool_settings["filter"]["sketch"] else False
         apply_cartoon = st.checkbox("Apply Cartoon Effect", value=False) if tool_settings["filter"]["cartoon"] else False
         apply_anime = st.checkbox("Apply Anime Effect", value=False) if tool_settings["filter"]["anime"] else False
+        lut_presets = [name for name in list_lut_presets() if tool_settings.get("lut", {}).get(name, True)]
+        lut_preset = None
+        if lut_presets:
+            lut_preset = st.selectbox("Color Grade (LUT)", [None] + lut_presets, 
+                                      format_func=lambda name: "None" if name is None else lut_display_name(name))
         
         st.markdown("### Text Customizations")
         font_folder = st.text_input("Font Folder Path", os.path.join(ASSETS_DIR, "fonts"))
-        upscale_factor = st.slider("Text Upscale Factor", 1, 8, 4)
+        output_preset = st.selectbox("Output Resolution", list(OUTPUT_PRESETS), 
+                                     index=list(OUTPUT_PRESETS).index(DEFAULT_OUTPUT_PRESET),
+                                     help="Images are composed at this size, so text and overlays stay sharp without upscaling")
         
         st.markdown("### Additional Overlays")
         use_frame = st.checkbox("Add Frame Overlay", value=False)
@@ -2368,7 +3802,7 @@ if st.button("✨ GENERATE", key="generate", use_container_width=True):
             st.stop()
     else:
         if 'num_images' in locals():
-            images = [("bg_{}.jpg".format(i+1), None) for i in range(num_images)]
+            images = [("bg_{}.jpg".format(i+1), None, []) for i in range(num_images)]
         else:
             st.warning("Please set number of images.")
             st.stop()
@@ -2420,7 +3854,7 @@ if st.button("✨ GENERATE", key="generate", use_container_width=True):
             watermark = group_data['watermark']
             group_images = group_data['images']
             
-            for filename, img in group_images:
+            for filename, img, face_boxes in group_images:
                 if generate_variants:
                     for v in range(num_variants):
                         settings = {
@@ -2467,11 +3901,12 @@ if st.button("✨ GENERATE", key="generate", use_container_width=True):
                             'apply_sketch': apply_sketch,
                             'apply_cartoon': apply_cartoon,
                             'apply_anime': apply_anime,
+                            'lut_preset': lut_preset,
                             'font_folder': font_folder,
-                            'upscale_factor': upscale_factor,
+                            'output_size': OUTPUT_PRESETS[output_preset],
                             'background_type': background_type
                         }
-                        variant = create_variant(img, settings)
+                        variant = create_variant(img, settings, face_boxes)
                         if variant is not None:
                             # Use new filename generation with timestamp options
                             filename = generate_filename(
@@ -2527,11 +3962,13 @@ if st.button("✨ GENERATE", key="generate", use_container_width=True):
                         'apply_sketch': apply_sketch,
                         'apply_cartoon': apply_cartoon,
                         'apply_anime': apply_anime,
+                        'lut_preset': lut_preset,
                         'font_folder': font_folder,
-                        'upscale_factor': upscale_factor,
+                        'output_size': OUTPUT_PRESETS[output_preset],
                         'background_type': background_type
                     }
-                    processed_img = create_variant(img, settings)
+                    processed_img = create_variant(img, settings, face_boxes)
+
                     if processed_img is not None:
                         # Use new filename generation with timestamp options
                         filename = generate_filename(
@@ -2547,6 +3984,7 @@ if st.button("✨ GENERATE", key="generate", use_container_width=True):
         
         if st.session_state.generated_images:
             log_image_usage(CURRENT_USER, len(st.session_state.generated_images))
+            flush_asset_usage()
             st.success(f"✅ Successfully processed {len(st.session_state.generated_images)} images with ULTRA PRO quality!")
         else:
             st.warning("No images were processed.")
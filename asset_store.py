@@ -0,0 +1,381 @@
+"""
+Persistent, content-addressed cache of the asset archive.
+
+The archive is extracted once into <cache>/tree and described by manifest.json: the
+archive's SHA-256 plus a CRC/size key for every member. When a new archive arrives, only
+members whose key changed are extracted and members that disappeared are deleted, so
+restarts reuse the tree as it is.
+
+The archive can also be mounted as a read-only virtual folder instead (mount_archive).
+Its central directory is indexed once, directory listings come from that index and
+members are read on demand, so nothing is extracted. list_dir, asset_exists,
+open_asset, read_asset and asset_version work for both mounted and regular paths.
+
+Decoded images can be precompiled into one RGBA bundle file (write_bundle). Processes
+memory-map it (open_bundle) and wrap its regions as read-only images without copying, so
+every process on a host shares one copy through the page cache.
+"""
+
+import io
+import os
+import json
+import mmap
+import time
+import struct
+import hashlib
+import zipfile
+import threading
+from PIL import Image
+
+MANIFEST_NAME = "manifest.json"
+TREE_DIR = "tree"
+ARCHIVE_NAME = "assets.zip"
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    SHA-256 of a file, read in chunks.
+
+    Args:
+        path (str): File to hash.
+        chunk_size (int, optional): Bytes per read. Defaults to 1 MiB.
+
+    Returns:
+        str: Hex digest.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def archive_members(zf: zipfile.ZipFile) -> dict:
+    """
+    Content keys of the archive's files, taken from the central directory (nothing is decompressed).
+
+    Args:
+        zf (zipfile.ZipFile): Open archive.
+
+    Returns:
+        dict: Member name -> "crc32:size".
+    """
+    return {info.filename: f"{info.CRC:08x}:{info.file_size}" for info in zf.infolist() if not info.is_dir()}
+
+def load_manifest(cache_dir: str) -> dict:
+    """
+    Manifest of the cached tree.
+
+    Args:
+        cache_dir (str): Asset cache folder.
+
+    Returns:
+        dict: The manifest, or {} when there is no usable cache yet.
+    """
+    try:
+        with open(os.path.join(cache_dir, MANIFEST_NAME), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_manifest(cache_dir: str, manifest: dict):
+    tmp_path = os.path.join(cache_dir, MANIFEST_NAME + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, os.path.join(cache_dir, MANIFEST_NAME))
+
+def cached_assets_root(cache_dir: str, max_age: float = None) -> str:
+    """
+    Assets folder of the cached tree, if there is one.
+
+    Args:
+        cache_dir (str): Asset cache folder.
+        max_age (float, optional): Maximum seconds since the last sync. None accepts any age.
+
+    Returns:
+        str: Path of the assets folder, or None when the cache is missing or too old.
+    """
+    manifest = load_manifest(cache_dir)
+    if not manifest:
+        return None
+    root = os.path.join(cache_dir, manifest["root"])
+    if not os.path.isdir(root):
+        return None
+    if max_age is not None and time.time() - manifest.get("synced_at", 0) > max_age:
+        return None
+    return root
+
+def sync_archive(archive_path: str, cache_dir: str, keep_as: str = None) -> str:
+    """
+    Bring the cached tree in line with an archive, extracting only members that changed.
+
+    Args:
+        archive_path (str): Zip to sync from, e.g. a fresh download or a local archive.
+        cache_dir (str): Asset cache folder.
+        keep_as (str, optional): Move the archive here once synced (used for downloads).
+            Defaults to None, which leaves the archive where it is.
+
+    Returns:
+        str: Path of the assets folder in the cache.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    tree = os.path.join(cache_dir, TREE_DIR)
+    manifest = load_manifest(cache_dir)
+    stat = os.stat(archive_path)
+    archive_stat = [stat.st_size, stat.st_mtime_ns]
+
+    # Same file as last time: skip hashing entirely
+    if manifest and manifest.get("archive_path") == os.path.abspath(archive_path) and manifest.get("archive_stat") == archive_stat:
+        sha = manifest["archive_sha256"]
+    else:
+        sha = file_sha256(archive_path)
+
+    if manifest.get("archive_sha256") != sha or not os.path.isdir(os.path.join(cache_dir, manifest.get("root", TREE_DIR))):
+        old_members = manifest.get("members", {})
+        try:
+            with zipfile.ZipFile(archive_path, "r") as zf:
+                members = archive_members(zf)
+                for name, key in members.items():
+                    target = os.path.join(tree, *name.split("/"))
+                    if old_members.get(name) != key or not os.path.exists(target):
+                        # ZipFile verifies each member's CRC while extracting it
+                        zf.extract(name, tree)
+        except zipfile.BadZipFile as e:
+            raise ValueError(f"Invalid ZIP file: {str(e)}")
+
+        for name in set(old_members) - set(members):
+            try:
+                os.remove(os.path.join(tree, *name.split("/")))
+            except OSError:
+                pass
+
+        root = TREE_DIR
+        if os.path.isdir(os.path.join(tree, "assets")):
+            root = os.path.join(TREE_DIR, "assets")
+        manifest = {"version": 1, "archive_sha256": sha, "members": members, "root": root}
+
+    if keep_as is not None:
+        os.replace(archive_path, keep_as)
+        archive_path = keep_as
+    manifest["archive_path"] = os.path.abspath(archive_path)
+    manifest["archive_stat"] = list(archive_stat)
+    manifest["synced_at"] = time.time()
+    _save_manifest(cache_dir, manifest)
+    return os.path.join(cache_dir, manifest["root"])
+
+_mounts = {}
+_mounts_lock = threading.Lock()
+
+def build_archive_index(archive_path: str, prefix: str = "") -> dict:
+    """
+    Index an archive's central directory.
+
+    Args:
+        archive_path (str): Zip to index.
+        prefix (str, optional): Only members under this folder ("assets/"), with it stripped.
+
+    Returns:
+        dict: The open archive, member infos by path, (subfolders, files) by folder and a lock.
+    """
+    zf = zipfile.ZipFile(archive_path, "r")
+    files = {}
+    dirs = {"": (set(), set())}
+    for info in zf.infolist():
+        if not info.filename.startswith(prefix):
+            continue
+        name = info.filename[len(prefix):].strip("/")
+        if not name:
+            continue
+        parts = name.split("/")
+        # Register every parent folder, since archives need not list folders explicitly
+        for i in range(len(parts) - 1):
+            dirs.setdefault("/".join(parts[:i]), (set(), set()))[0].add(parts[i])
+            dirs.setdefault("/".join(parts[:i + 1]), (set(), set()))
+        parent = "/".join(parts[:-1])
+        if info.is_dir():
+            dirs[parent][0].add(parts[-1])
+            dirs.setdefault(name, (set(), set()))
+        else:
+            dirs[parent][1].add(parts[-1])
+            files[name] = info
+    return {
+        "archive_path": os.path.abspath(archive_path),
+        "mtime_ns": os.stat(archive_path).st_mtime_ns,
+        "zip": zf,
+        "files": files,
+        "dirs": {d: (sorted(sub), sorted(names)) for d, (sub, names) in dirs.items()},
+        "lock": threading.Lock()
+    }
+
+def mount_archive(root: str, archive_path: str) -> str:
+    """
+    Serve an archive's members under a virtual folder, without extracting them.
+
+    Args:
+        root (str): Virtual folder the archive appears at; it need not exist on disk.
+        archive_path (str): Zip to mount.
+
+    Returns:
+        str: The virtual assets folder (root, or the archive's top-level assets folder under it).
+    """
+    root = os.path.abspath(root)
+    with zipfile.ZipFile(archive_path, "r") as zf:
+        has_assets = any(name.startswith("assets/") for name in zf.namelist())
+    prefix = "assets/" if has_assets else ""
+    index = build_archive_index(archive_path, prefix)
+    with _mounts_lock:
+        old = _mounts.get(root)
+        _mounts[root] = index
+    if old is not None:
+        old["zip"].close()
+    return root
+
+def is_archive_path(path: str) -> bool:
+    """Whether path lies inside a mounted archive."""
+    return _resolve(path) is not None
+
+def _resolve(path: str):
+    path = os.path.abspath(path)
+    for root, index in list(_mounts.items()):
+        if path == root:
+            return index, ""
+        if path.startswith(root + os.sep):
+            return index, os.path.relpath(path, root).replace(os.sep, "/")
+    return None
+
+def list_dir(path: str) -> tuple:
+    """
+    Subfolders and files of a folder.
+
+    Args:
+        path (str): Folder, mounted or regular.
+
+    Returns:
+        tuple: (sorted subfolder names, sorted file names).
+    """
+    resolved = _resolve(path)
+    if resolved is None:
+        with os.scandir(path) as entries:
+            entries = list(entries)
+        return sorted(e.name for e in entries if e.is_dir()), sorted(e.name for e in entries if e.is_file())
+    index, rel = resolved
+    if rel not in index["dirs"]:
+        raise FileNotFoundError(path)
+    subfolders, files = index["dirs"][rel]
+    return list(subfolders), list(files)
+
+def asset_exists(path: str) -> bool:
+    resolved = _resolve(path)
+    if resolved is None:
+        return os.path.exists(path)
+    index, rel = resolved
+    return rel in index["files"] or rel in index["dirs"]
+
+def read_asset(path: str) -> bytes:
+    """Contents of a file, mounted or regular."""
+    resolved = _resolve(path)
+    if resolved is None:
+        with open(path, "rb") as f:
+            return f.read()
+    index, rel = resolved
+    info = index["files"].get(rel)
+    if info is None:
+        raise FileNotFoundError(path)
+    with index["lock"]:
+        return index["zip"].read(info)
+
+def open_asset(path: str):
+    """What Image.open needs to read a file: the path itself, or an in-memory copy of an archive member."""
+    if _resolve(path) is None:
+        return path
+    return io.BytesIO(read_asset(path))
+
+def asset_version(path: str) -> tuple:
+    """
+    A key that changes whenever the file or folder changes.
+
+    Args:
+        path (str): File or folder, mounted or regular.
+
+    Returns:
+        tuple: (mtime_ns, size) on disk; (crc, size) for archive files and the archive's
+            mtime for archive folders.
+    """
+    resolved = _resolve(path)
+    if resolved is None:
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+    index, rel = resolved
+    info = index["files"].get(rel)
+    if info is not None:
+        return (info.CRC, info.file_size)
+    if rel in index["dirs"]:
+        return (index["mtime_ns"], 0)
+    raise FileNotFoundError(path)
+
+BUNDLE_MAGIC = b"RGBABDL1"
+BUNDLE_HEADER = struct.Struct("<8sQQ")
+BUNDLE_ALIGN = 4096
+
+def write_bundle(out_path: str, images) -> int:
+    """
+    Write decoded RGBA images and their index into one file.
+
+    Args:
+        out_path (str): Bundle file to write (replaced atomically).
+        images (iterable): (key, RGBA image, metadata dict) tuples; consumed one at a time.
+
+    Returns:
+        int: Number of images written.
+    """
+    index = {}
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(b"\0" * BUNDLE_HEADER.size)
+        for key, img, meta in images:
+            # Page-aligned pixel data keeps each image on its own pages of the mapping
+            f.write(b"\0" * (-f.tell() % BUNDLE_ALIGN))
+            index[key] = dict(meta, offset=f.tell(), size=list(img.size))
+            f.write(img.tobytes())
+        index_data = json.dumps(index).encode()
+        index_offset = f.tell()
+        f.write(index_data)
+        f.seek(0)
+        f.write(BUNDLE_HEADER.pack(BUNDLE_MAGIC, index_offset, len(index_data)))
+    os.replace(tmp_path, out_path)
+    return len(index)
+
+def open_bundle(path: str) -> dict:
+    """
+    Memory-map a bundle written by write_bundle.
+
+    Args:
+        path (str): Bundle file.
+
+    Returns:
+        dict: The mapping, the index by key and the mapped size in bytes.
+    """
+    with open(path, "rb") as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, index_offset, index_length = BUNDLE_HEADER.unpack_from(mapping, 0)
+    if magic != BUNDLE_MAGIC:
+        mapping.close()
+        raise ValueError(f"{path} is not an asset bundle")
+    index = json.loads(mapping[index_offset:index_offset + index_length])
+    return {"path": path, "mmap": mapping, "index": index, "bytes": len(mapping)}
+
+def bundle_image(bundle: dict, key: str):
+    """
+    Image backed directly by the bundle's mapping; PIL copies it on the first write.
+
+    Args:
+        bundle (dict): Bundle from open_bundle.
+        key (str): Image key.
+
+    Returns:
+        PIL.Image.Image: Read-only RGBA image, or None when the key is not in the bundle.
+    """
+    entry = bundle["index"].get(key)
+    if entry is None:
+        return None
+    w, h = entry["size"]
+    view = memoryview(bundle["mmap"])[entry["offset"]:entry["offset"] + w * h * 4]
+    return Image.frombuffer("RGBA", (w, h), view, "raw", "RGBA", 0, 1)
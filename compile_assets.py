@@ -0,0 +1,249 @@
+"""
+Offline asset-pack compiler.
+
+Crops every overlay PNG to its alpha bounding box, stores half- and quarter-size
+pyramid levels next to it and suggests an overlap percent per theme. Everything is
+written under <assets>/compiled together with manifest.json, which app.py loads.
+
+With --bundle it also decodes the overlays, pets, logos, flags and frames into one
+memory-mappable RGBA bundle (see asset_store.write_bundle). Run it against the assets
+folder (or, for ASSETS_MODE=zip, the asset zip) that the app serves, since bundle
+entries are only used while their source file is unchanged.
+
+Usage:
+    python compile_assets.py [ASSETS_DIR] [--bundle] [--bundle-out PATH]
+    python compile_assets.py assets.zip --bundle --bundle-out asset_cache/assets.bundle
+"""
+
+import io
+import os
+import zlib
+
+import json
+import argparse
+import numpy as np
+from PIL import Image
+from asset_store import mount_archive, list_dir, read_asset, open_asset, asset_version, write_bundle
+
+COMPILED_DIR = "compiled"
+MANIFEST_NAME = "manifest.json"
+PYRAMID_LEVELS = [2, 4]
+ALPHA_THRESHOLD = 16
+OVERLAP_CLEARANCE = 0.02
+OVERLAP_RANGE = (-15, 50)
+BUNDLE_NAME = "assets.bundle"
+BUNDLE_FOLDERS = ["overlays", "pets", "logos", "flags", "frames", f"{COMPILED_DIR}/overlays"]
+BUNDLE_EXTENSIONS = [".png", ".jpg", ".jpeg"]
+
+def list_themes(overlays_dir: str) -> list:
+    """
+    List overlay themes the same way the app does.
+
+    Args:
+        overlays_dir (str): The assets/overlays folder.
+
+    Returns:
+        list: (year, theme, folder) tuples. A year without subfolders is itself the theme.
+    """
+    themes = []
+    if not os.path.isdir(overlays_dir):
+        return themes
+    for year in sorted(os.listdir(overlays_dir)):
+        year_path = os.path.join(overlays_dir, year)
+        if not os.path.isdir(year_path):
+            continue
+        subfolders = sorted(d for d in os.listdir(year_path) if os.path.isdir(os.path.join(year_path, d)))
+        if not subfolders:
+            themes.append((year, year, year_path))
+        for theme in subfolders:
+            themes.append((year, theme, os.path.join(year_path, theme)))
+    return themes
+
+def compile_image(src_path: str, rel_path: str, assets_dir: str) -> dict:
+    """
+    Trim one overlay to its alpha bounding box and write its pyramid levels.
+
+    Args:
+        src_path (str): Source PNG.
+        rel_path (str): Path of the PNG relative to the assets folder, with "/" separators.
+        assets_dir (str): Assets folder; output goes under its compiled/ folder.
+
+    Returns:
+        dict: Manifest entry with the original size, the bbox, the relative path of each level and
+            the source's version and crc, or None when the image is fully transparent.
+    """
+    data = read_asset(src_path)
+    img = Image.open(io.BytesIO(data)).convert("RGBA")
+    bbox = img.getchannel("A").point(lambda a: 255 if a > 0 else 0).getbbox()
+    if bbox is None:
+        return None
+
+    trimmed = img.crop(bbox)
+    out_rel = f"{COMPILED_DIR}/{rel_path}"
+    out_path = os.path.join(assets_dir, *out_rel.split("/"))
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    trimmed.save(out_path, optimize=True)
+    levels = {"1": out_rel}
+
+    stem, ext = os.path.splitext(out_rel)
+    level_img = trimmed
+    previous = 1
+    for factor in PYRAMID_LEVELS:
+        level_img = level_img.reduce(factor // previous)
+        previous = factor
+        if min(level_img.size) < 1:
+            break
+        level_rel = f"{stem}@{factor}{ext}"
+        level_img.save(os.path.join(assets_dir, *level_rel.split("/")), optimize=True)
+        levels[str(factor)] = level_rel
+
+    # Same source stamp as the bundle, so app.py can tell when the levels are stale
+    return {"size": list(img.size), "bbox": list(bbox), "levels": levels,
+            "version": list(asset_version(src_path)), "crc": zlib.crc32(data), "bytes": len(data)}
+
+def _ink_extents(alpha: np.ndarray, width: int) -> tuple:
+    """First and last inked row of every column, with the image centred in a strip of the given width."""
+    ink = alpha > ALPHA_THRESHOLD
+    h, w = ink.shape
+    left = (width - w) // 2
+    has_ink = np.zeros(width, dtype=bool)
+    first = np.zeros(width, dtype=np.int64)
+    last = np.zeros(width, dtype=np.int64)
+    has_ink[left:left + w] = ink.any(axis=0)
+    first[left:left + w] = np.argmax(ink, axis=0)
+    last[left:left + w] = h - 1 - np.argmax(ink[::-1], axis=0)
+    return has_ink, first, last
+
+def suggest_overlap(upper: Image.Image, lower: Image.Image, clearance: float = OVERLAP_CLEARANCE) -> int:
+    """
+    Overlap percent that tucks the lower greeting PNG under the upper one without touching it.
+
+    Works on the column-wise alpha profiles of both images laid out as create_variant stacks
+    them (horizontally centred), so the words interlock where their ink allows.
+
+    Args:
+        upper (PIL.Image.Image): Upper PNG, e.g. 1.png.
+        lower (PIL.Image.Image): Lower PNG, e.g. 2.png or 3.png.
+        clearance (float, optional): Space to keep between the inks, as a fraction of the
+            smaller height. Defaults to 0.02.
+
+    Returns:
+        int: Suggested overlap percent, clamped to the range of the admin slider.
+    """
+    width = max(upper.width, lower.width)
+    min_h = min(upper.height, lower.height)
+    up_has, _, up_last = _ink_extents(np.asarray(upper.getchannel("A")), width)
+    low_has, low_first, _ = _ink_extents(np.asarray(lower.getchannel("A")), width)
+
+    both = up_has & low_has
+    if not both.any():
+        # No shared columns: fall back to the row extents of each image
+        both = up_has | low_has
+        up_last = np.full(width, up_last[up_has].max() if up_has.any() else upper.height - 1)
+        low_first = np.full(width, low_first[low_has].min() if low_has.any() else 0)
+
+    # Gap between the frames (negative = overlap) needed to keep every column clear
+    gap = int((up_last[both] + 1 - upper.height - low_first[both]).max()) + clearance * min_h
+    percent = round(-gap * 100 / min_h)
+    return int(min(max(percent, OVERLAP_RANGE[0]), OVERLAP_RANGE[1]))
+
+def compile_assets(assets_dir: str) -> dict:
+    """
+    Compile all overlay themes under assets_dir and write the manifest.
+
+    Args:
+        assets_dir (str): Assets folder containing overlays/.
+
+    Returns:
+        dict: The manifest that was written.
+    """
+    manifest = {"version": 1, "images": {}, "themes": {}}
+    for year, theme, folder in list_themes(os.path.join(assets_dir, "overlays")):
+        members = {}
+        for name in sorted(os.listdir(folder)):
+            if not name.lower().endswith(".png"):
+                continue
+            src_path = os.path.join(folder, name)
+            rel_path = os.path.relpath(src_path, assets_dir).replace(os.sep, "/")
+            entry = compile_image(src_path, rel_path, assets_dir)
+            if entry is not None:
+                manifest["images"][rel_path] = entry
+                members[name] = src_path
+
+        suggestions = []
+        for lower in ["2.png", "3.png"]:
+            if "1.png" in members and lower in members:
+                suggestions.append(suggest_overlap(Image.open(members["1.png"]).convert("RGBA"),
+                                                   Image.open(members[lower]).convert("RGBA")))
+        if suggestions:
+            # Use the tighter of the Good Morning / Good Night pairs so neither collides
+            manifest["themes"][f"{year}_{theme}"] = {"suggested_overlap": min(suggestions)}
+
+    with open(os.path.join(assets_dir, COMPILED_DIR, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+def _bundle_images(assets_dir: str):
+    """Yield (key, RGBA image, metadata) for every image under the bundled folders."""
+    pending = [folder for folder in BUNDLE_FOLDERS if _exists_in(assets_dir, folder)]
+    while pending:
+        rel_dir = pending.pop(0)
+        subfolders, files = list_dir(os.path.join(assets_dir, *rel_dir.split("/")))
+        pending.extend(f"{rel_dir}/{name}" for name in subfolders)
+        for name in files:
+            if not any(name.lower().endswith(ext) for ext in BUNDLE_EXTENSIONS):
+                continue
+            path = os.path.join(assets_dir, *rel_dir.split("/"), name)
+            try:
+                img = Image.open(open_asset(path)).convert("RGBA")
+            except Exception:
+                continue
+            version = asset_version(path)
+            data = read_asset(path)
+            meta = {"version": list(version), "crc": zlib.crc32(data), "bytes": len(data)}
+            yield f"{rel_dir}/{name}", img, meta
+
+def _exists_in(assets_dir: str, folder: str) -> bool:
+    try:
+        list_dir(os.path.join(assets_dir, *folder.split("/")))
+        return True
+    except OSError:
+        return False
+
+def compile_bundle(assets_dir: str, out_path: str) -> int:
+    """
+    Decode every bundled image under assets_dir into one memory-mappable RGBA bundle.
+
+    Args:
+        assets_dir (str): Assets folder, regular or mounted from the asset zip.
+        out_path (str): Bundle file to write.
+
+    Returns:
+        int: Number of images bundled.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    return write_bundle(out_path, _bundle_images(assets_dir))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile the asset pack")
+    parser.add_argument("assets", nargs="?", default=os.path.join(os.getcwd(), "assets"), 
+                        help="assets folder, or the asset zip (bundle only)")
+    parser.add_argument("--bundle", action="store_true", help="also write the memory-mapped RGBA bundle")
+    parser.add_argument("--bundle-out", help="bundle file (default: <assets>/compiled/assets.bundle)")
+    args = parser.parse_args()
+    
+    if args.assets.lower().endswith(".zip"):
+        if not args.bundle or not args.bundle_out:
+            parser.error("a zip can only be compiled into a bundle: pass --bundle and --bundle-out")
+        assets_dir = mount_archive(os.path.join(os.path.dirname(os.path.abspath(args.assets)), "archive"), args.assets)
+    else:
+        assets_dir = args.assets
+        os.makedirs(os.path.join(assets_dir, COMPILED_DIR), exist_ok=True)
+        result = compile_assets(assets_dir)
+        print(f"Compiled {len(result['images'])} overlay images, {len(result['themes'])} overlap suggestions "
+              f"-> {os.path.join(assets_dir, COMPILED_DIR, MANIFEST_NAME)}")
+    
+    if args.bundle:
+        bundle_out = args.bundle_out or os.path.join(assets_dir, COMPILED_DIR, BUNDLE_NAME)
+        count = compile_bundle(assets_dir, bundle_out)
+        print(f"Bundled {count} decoded images -> {bundle_out}")
@@ -1,6 +1,8 @@
 # utils.py
 
 import os
+import xml.etree.ElementTree as ET
+import numpy as np
 from PIL import Image
 
 def list_subfolders(directory: str) -> list:
@@ -38,25 +40,228 @@ def generate_preview(year: int, theme: str, new_value: str) -> str:
     print("Generated Preview:", preview)
     return preview
 
-def smart_crop(img: Image.Image, target_ratio: float = 3/4) -> Image.Image:
+def smart_crop(img: Image.Image, target_ratio: float = 3/4, focus_boxes: list = None) -> Image.Image:
     """
     Crop image to target aspect ratio (default 3:4).
     
     Args:
         img (PIL.Image.Image): Input image.
         target_ratio (float, optional): Desired width/height ratio. Defaults to 3/4.
+        focus_boxes (list, optional): (x, y, w, h) boxes, e.g. faces, to keep inside the crop.
+            The crop is centred on them instead of the image centre. Defaults to None.
     
     Returns:
         PIL.Image.Image: Cropped image.
     """
-    w, h = img.size
+    return img.crop(smart_crop_box(img.size, target_ratio, focus_boxes))
+
+def smart_crop_box(size: tuple, target_ratio: float = 3/4, focus_boxes: list = None) -> tuple:
+    """
+    Crop window (left, top, right, bottom) used by smart_crop.
+    
+    Args:
+        size (tuple): Image (width, height).
+        target_ratio (float, optional): Desired width/height ratio. Defaults to 3/4.
+        focus_boxes (list, optional): (x, y, w, h) boxes to centre the window on. Defaults to None.
+    
+    Returns:
+        tuple: Crop box in image coordinates.
+    """
+    w, h = size
     if w / h > target_ratio:
         # Image is too wide
         new_w = int(h * target_ratio)
         left = (w - new_w) // 2
-        return img.crop((left, 0, left + new_w, h))
+        if focus_boxes:
+            left = _focus_offset(focus_boxes, 0, new_w, w)
+        return (left, 0, left + new_w, h)
     else:
         # Image is too tall
         new_h = int(w / target_ratio)
         top = (h - new_h) // 2
-        return img.crop((0, top, w, top + new_h))
+        if focus_boxes:
+            top = _focus_offset(focus_boxes, 1, new_h, h)
+        return (0, top, w, top + new_h)
+
+def _focus_offset(boxes: list, axis: int, window: int, total: int) -> int:
+    """Start of a window along one axis that is centred on the union of the boxes, clamped to the image."""
+    lo = min(b[axis] for b in boxes)
+    hi = max(b[axis] + b[axis + 2] for b in boxes)
+    start = (lo + hi) // 2 - window // 2
+    return max(0, min(start, total - window))
+
+def load_haar_cascade(path: str) -> dict:
+    """
+    Load an OpenCV Haar cascade XML (stump-based, new format) into NumPy arrays.
+    
+    Args:
+        path (str): Path to the cascade XML, e.g. haarcascade_frontalface_default.xml.
+    
+    Returns:
+        dict: Window size, per-feature rects and weights, and per-stage stump parameters.
+    """
+    cascade = ET.parse(path).getroot().find("cascade")
+    win_w = int(cascade.find("width").text)
+    win_h = int(cascade.find("height").text)
+    
+    rects = []
+    weights = []
+    for feature in cascade.find("features"):
+        feature_rects = np.zeros((3, 4), dtype=np.int64)
+        feature_weights = np.zeros(3)
+        for i, rect in enumerate(feature.find("rects")):
+            values = rect.text.split()
+            feature_rects[i] = [int(v) for v in values[:4]]
+            feature_weights[i] = float(values[4])
+        rects.append(feature_rects)
+        weights.append(feature_weights)
+    
+    stages = []
+    for stage in cascade.find("stages"):
+        features, thresholds, left, right = [], [], [], []
+        for weak in stage.find("weakClassifiers"):
+            nodes = weak.find("internalNodes").text.split()
+            leaves = weak.find("leafValues").text.split()
+            features.append(int(nodes[2]))
+            thresholds.append(float(nodes[3]))
+            left.append(float(leaves[0]))
+            right.append(float(leaves[1]))
+        stages.append({
+            "threshold": float(stage.find("stageThreshold").text),
+            "features": np.array(features),
+            "thresholds": np.array(thresholds),
+            "left": np.array(left),
+            "right": np.array(right)
+        })
+    
+    return {
+        "size": (win_w, win_h),
+        "rects": np.array(rects),
+        "weights": np.array(weights),
+        "stages": stages
+    }
+
+def _integral(arr: np.ndarray) -> np.ndarray:
+    ii = np.zeros((arr.shape[0] + 1, arr.shape[1] + 1))
+    ii[1:, 1:] = arr.cumsum(0).cumsum(1)
+    return ii
+
+def _group_detections(boxes: list, min_neighbors: int, eps: float = 0.2) -> list:
+    """Merge overlapping window hits the way OpenCV's groupRectangles does."""
+    n = len(boxes)
+    parent = list(range(n))
+    
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    
+    for i in range(n):
+        x1, y1, w1, h1 = boxes[i]
+        for j in range(i + 1, n):
+            x2, y2, w2, h2 = boxes[j]
+            delta = eps * (min(w1, w2) + min(h1, h2)) * 0.5
+            if (abs(x1 - x2) <= delta and abs(y1 - y2) <= delta and 
+                    abs(x1 + w1 - x2 - w2) <= delta and abs(y1 + h1 - y2 - h2) <= delta):
+                parent[find(i)] = find(j)
+    
+    clusters = {}
+    for i in range(n):
+        clusters.setdefault(find(i), []).append(boxes[i])
+    
+    grouped = []
+    for members in clusters.values():
+        if len(members) > min_neighbors:
+            grouped.append(tuple(int(round(v)) for v in np.mean(members, axis=0)))
+    return grouped
+
+def detect_faces(img: Image.Image, cascade: dict, max_side: int = 320, scale_factor: float = 1.25, 
+                 min_neighbors: int = 3, step: int = 2) -> list:
+    """
+    Detect faces with a Haar cascade using integral images and NumPy (no OpenCV needed).
+    
+    The image is downscaled so its longer side is at most max_side, and every pyramid level is
+    packed into one integral image with a shared row stride. That way each cascade stage is
+    evaluated for all surviving windows of all levels in a single vectorized pass.
+    
+    Args:
+        img (PIL.Image.Image): Input image.
+        cascade (dict): Cascade from load_haar_cascade.
+        max_side (int, optional): Longer side of the detection copy. Defaults to 320.
+        scale_factor (float, optional): Pyramid step between levels. Defaults to 1.25.
+        min_neighbors (int, optional): Hits a detection needs to be kept. Defaults to 3.
+        step (int, optional): Window stride in pixels of each level. Defaults to 2.
+    
+    Returns:
+        list: (x, y, w, h) face boxes in the coordinates of img.
+    """
+    win_w, win_h = cascade["size"]
+    base_scale = max(1.0, max(img.size) / max_side)
+    base = img.convert("L")
+    if base_scale > 1.0:
+        base = base.resize((int(img.width / base_scale), int(img.height / base_scale)), Image.BILINEAR)
+    
+    levels = []
+    factor = 1.0
+    while base.width / factor >= win_w and base.height / factor >= win_h:
+        levels.append(factor)
+        factor *= scale_factor
+    if not levels:
+        return []
+    
+    stride = base.width + 1
+    sums, sqsums, window_index, window_boxes = [], [], [], []
+    row = 0
+    for factor in levels:
+        level = base if factor == 1.0 else base.resize((int(base.width / factor), int(base.height / factor)), Image.BILINEAR)
+        arr = np.asarray(level, dtype=np.float64)
+        ii = np.zeros((arr.shape[0] + 1, stride))
+        ii2 = np.zeros((arr.shape[0] + 1, stride))
+        ii[:, :arr.shape[1] + 1] = _integral(arr)
+        ii2[:, :arr.shape[1] + 1] = _integral(arr * arr)
+        sums.append(ii)
+        sqsums.append(ii2)
+        
+        ys, xs = np.mgrid[0:arr.shape[0] - win_h + 1:step, 0:arr.shape[1] - win_w + 1:step]
+        window_index.append(((row + ys) * stride + xs).ravel())
+        window_boxes.append(np.stack([xs.ravel() * factor, ys.ravel() * factor, 
+                                      np.full(xs.size, win_w * factor), np.full(xs.size, win_h * factor)], axis=1))
+        row += arr.shape[0] + 1
+    
+    ii = np.concatenate(sums).ravel()
+    ii2 = np.concatenate(sqsums).ravel()
+    active = np.concatenate(window_index)
+    boxes = np.concatenate(window_boxes)
+    
+    def corner_offsets(x, y, w, h):
+        return (y * stride + x, y * stride + x + w, (y + h) * stride + x, (y + h) * stride + x + w)
+    
+    # Variance normalisation over the inner window, as OpenCV does
+    norm = corner_offsets(1, 1, win_w - 2, win_h - 2)
+    area = (win_w - 2) * (win_h - 2)
+    win_sum = ii[active + norm[0]] - ii[active + norm[1]] - ii[active + norm[2]] + ii[active + norm[3]]
+    win_sqsum = ii2[active + norm[0]] - ii2[active + norm[1]] - ii2[active + norm[2]] + ii2[active + norm[3]]
+    nf = area * win_sqsum - win_sum * win_sum
+    nf = np.where(nf > 0, np.sqrt(np.maximum(nf, 0)), 1.0)
+    
+    r = cascade["rects"]
+    offsets = np.stack(corner_offsets(r[..., 0], r[..., 1], r[..., 2], r[..., 3]), axis=-1)
+    weights = cascade["weights"]
+    keep = np.arange(active.size)
+    
+    for stage in cascade["stages"]:
+        if keep.size == 0:
+            return []
+        base_idx = active[keep][:, None]
+        stage_offsets = offsets[stage["features"]]
+        value = np.zeros((keep.size, stage["features"].size))
+        for k in range(3):
+            o = stage_offsets[:, k, :]
+            rect_sum = ii[base_idx + o[:, 0]] - ii[base_idx + o[:, 1]] - ii[base_idx + o[:, 2]] + ii[base_idx + o[:, 3]]
+            value += rect_sum * weights[stage["features"], k]
+        votes = np.where(value < stage["thresholds"] * nf[keep][:, None], stage["left"], stage["right"]).sum(axis=1)
+        keep = keep[votes >= stage["threshold"]]
+    
+    hits = (boxes[keep] * base_scale).tolist()
+    return _group_detections(hits, min_neighbors)